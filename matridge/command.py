@@ -1,4 +1,5 @@
-from typing import Union
+import time
+from typing import Sequence, Union
 
 import nio
 from nio.crypto import OlmDevice, TrustState
@@ -6,7 +7,8 @@ from slidge.command import Command, CommandAccess, Form, FormField, TableResult
 from slidge.command.base import FormValues
 from slixmpp.exceptions import XMPPError
 
-from .group import MUC
+from . import profiling
+from .monitor import session_stats
 from .session import Session
 
 
@@ -17,11 +19,9 @@ class ListSpaces(Command):
     ACCESS = CommandAccess.USER_LOGGED
 
     async def run(self, session: Session, _ifrom, *args: str) -> Form:  # type:ignore
-        spaces = list[nio.MatrixRoom]()
-        for room in session.matrix.rooms.values():
-            if room.children:
-                spaces.append(room)
-        spaces = sorted(spaces, key=lambda r: r.name)
+        rooms = session.matrix.rooms
+        spaces = [rooms[i] for i in session.matrix.spaces if i in rooms]
+        spaces = sorted(spaces, key=lambda r: r.name or "")
         return Form(
             title=self.NAME,
             instructions="Choose a space to list its children rooms. "
@@ -49,19 +49,28 @@ class ListSpaces(Command):
         rooms: list[nio.MatrixRoom],
     ):
         space = rooms[int(form_values["space"])]  # type:ignore
-        mucs = list[MUC]()
+        # (name, JID)
+        items = list[tuple[str, str]]()
         for room_id in space.children:
-            try:
-                mucs.append(await session.bookmarks.by_legacy_id(room_id))
-            except XMPPError:
+            if muc := session.bookmarks.get_known(room_id):
+                items.append((muc.name, muc.jid.bare))
                 continue
+            # building MUCs for all the rooms of a large space takes a while,
+            # so rooms that have not been used on the XMPP side yet are
+            # listed from what nio knows about them
+            room = session.matrix.rooms.get(room_id)
+            if room is None or room.children:
+                # not joined, or a sub-space, which cannot be joined as a MUC
+                # (see MUC.update_info()) and is listed by run() instead
+                continue
+            local = await session.bookmarks.legacy_id_to_jid_local_part(room_id)
+            items.append((room.name or "unnamed", f"{local}@{session.xmpp.boundjid}"))
 
-        mucs = sorted(mucs, key=lambda muc: muc.name)
         return TableResult(
             fields=[FormField("name"), FormField("jid", type="jid-single")],
             description=f"Rooms of '{space.name or 'unnamed'}'",
             jids_are_mucs=True,
-            items=[{"name": muc.name, "jid": str(muc.jid)} for muc in mucs],
+            items=[{"name": name, "jid": jid} for name, jid in sorted(items)],
         )
 
 
@@ -91,15 +100,10 @@ class ManageTrust(Command):
         # this part if for chat commands only
         if args:
             if args[0] == "all":
-                return await self.step2(
-                    {
-                        "device": list(device_dict.keys()),  # type:ignore
-                        "new_state": "verified",
-                    },
-                    session,
-                    None,
-                    device_dict,
-                )
+                # verify all [USER_ID]
+                user_id = args[1] if len(args) > 1 else None
+                changed = session.matrix.set_trust(TrustState.verified, user_id=user_id)
+                return f"{len(changed)} sessions are now verified."
 
             else:
                 return await self.step2(
@@ -143,26 +147,22 @@ class ManageTrust(Command):
         devices: dict[str, OlmDevice],
     ):
         new_state = form_values["new_state"]
-        matrix = session.matrix
+        selected = form_values["device"]
+        # a single device when called from the chat command
+        device_ids: list[str] = (
+            [selected] if isinstance(selected, str) else selected  # type:ignore
+        )
+        changed = {
+            d.id
+            for d in session.matrix.set_trust(
+                TrustState[new_state],  # type:ignore
+                [devices[device_name] for device_name in device_ids],
+            )
+        }
         result = ""
-        for device_name in form_values["device"]:  # type:ignore
+        for device_name in device_ids:
             device = devices[device_name]
-            change = False
-            if new_state == "unset":
-                if device.trust_state == TrustState.verified:
-                    change = matrix.unverify_device(device)
-                elif device.trust_state == TrustState.ignored:
-                    change = matrix.unignore_device(device)
-                elif device.trust_state == TrustState.blacklisted:
-                    change = matrix.unblacklist_device(device)
-            elif new_state == "verified":
-                change = session.matrix.verify_device(device)
-            elif new_state == "blacklisted":
-                change = session.matrix.blacklist_device(device)
-            elif new_state == "ignored":
-                change = session.matrix.ignore_device(device)
-
-            if change:
+            if device.id in changed:
                 result += (
                     f"\nThe status of {self.__human_device(device, False)} "
                     f"is now {new_state}."
@@ -174,3 +174,172 @@ class ManageTrust(Command):
                 )
 
         return result or "Nothing was changed."
+
+
+class Monitor(Command):
+    NAME = "Performance monitor"
+    CHAT_COMMAND = NODE = "monitor"
+    HELP = "Show the event loop lag and the resources used by each user"
+    ACCESS = CommandAccess.ADMIN_ONLY
+
+    async def run(self, _session, _ifrom, *args: str) -> TableResult:
+        monitor = self.xmpp.loop_monitor  # type:ignore
+        if monitor is None:
+            description = "The event loop monitor is disabled."
+        else:
+            description = f"Maximum event loop lag: {monitor.max_lag * 1000:.0f}ms."
+            if monitor.stalls:
+                description += "\nLast stalls:\n" + "\n".join(
+                    map(str, reversed(monitor.stalls))
+                )
+
+        items = []
+        for session in self.xmpp.sessions():  # type:ignore
+            if not session.logged:
+                continue
+            stats = session_stats(session)
+            items.append(
+                {"jid": session.user.bare_jid, **{k: str(v) for k, v in stats.items()}}
+            )
+        fields = [FormField("jid", type="jid-single")]
+        if items:
+            fields.extend(FormField(k) for k in items[0] if k != "jid")
+        return TableResult(description=description, fields=fields, items=items)
+
+
+class Caches(Command):
+    NAME = "Caches"
+    CHAT_COMMAND = NODE = "caches"
+    HELP = (
+        "Show the sizes and hit rates of the caches and the timing of the sync "
+        "loops, and optionally flush caches. Usage: caches [flush CACHE...]"
+    )
+    ACCESS = CommandAccess.ADMIN_ONLY
+
+    CACHES = {
+        "get_event": "Matrix events",
+        "get_original_id": "Original IDs of edited events",
+        "reactions": "Reactions (per user)",
+    }
+
+    async def run(self, _session, _ifrom, *args: str) -> Union[Form, str]:
+        sessions = [s for s in self.xmpp.sessions() if s.logged]  # type:ignore
+        if args:
+            if args[0] != "flush" or not set(args[1:]) <= self.CACHES.keys():
+                raise XMPPError("bad-request", self.HELP)
+            return self.flush(sessions, args[1:])
+
+        lines = []
+        for name in "get_event", "get_original_id":
+            infos = [getattr(s.matrix, name).cache_info() for s in sessions]
+            hits = sum(i.hits for i in infos)
+            misses = sum(i.misses for i in infos)
+            rate = f"{hits / (hits + misses):.0%}" if hits + misses else "n/a"
+            lines.append(
+                f"{name}: {sum(i.currsize for i in infos)} entries, "
+                f"{hits} hits, {misses} misses ({rate} hit rate)"
+            )
+        reactions = [s.matrix.reactions.stats() for s in sessions]
+        lines.append(
+            f"reactions: {sum(r['targets'] for r in reactions)} messages, "
+            f"{sum(r['events'] for r in reactions)} reactions"
+        )
+        lines.append(
+            "events_to_ignore: "
+            f"{sum(len(s.events_to_ignore) for s in sessions)} events"
+        )
+        for session in sessions:
+            lines.append(f"{session.user.bare_jid}: {self.__sync(session)}")
+
+        return Form(
+            title=self.NAME,
+            instructions="\n".join(lines),
+            handler=self.finish,  # type:ignore
+            handler_args=(sessions,),
+            fields=[
+                FormField(
+                    "flush",
+                    label="Caches to flush",
+                    type="list-multi",
+                    options=[{"label": v, "value": k} for k, v in self.CACHES.items()],
+                )
+            ],
+        )
+
+    @staticmethod
+    def __sync(session: Session) -> str:
+        stats = session.matrix.sync_stats
+        if stats.last is None:
+            last = "no sync yet"
+        else:
+            last = (
+                f"last sync {time.time() - stats.last:.0f}s ago, took "
+                f"{stats.last_duration:.2f}s (handling: {stats.last_handling:.2f}s)"
+            )
+        r = f"{stats.syncs} syncs, {last}, {stats.retries} retries"
+        if stats.last_error:
+            r += f" (last error: {stats.last_error})"
+        return r
+
+    async def finish(
+        self, form_values: FormValues, _session, _ifrom, sessions: list[Session]
+    ):
+        return self.flush(sessions, form_values.get("flush") or [])  # type:ignore
+
+    @staticmethod
+    def flush(sessions: list[Session], caches: Sequence[str]) -> str:
+        for cache in caches:
+            for session in sessions:
+                if cache == "reactions":
+                    session.matrix.reactions.clear()
+                else:
+                    getattr(session.matrix, cache).cache_clear()
+        if not caches:
+            return "Nothing was flushed."
+        return "Flushed: " + ", ".join(caches)
+
+
+class Profile(Command):
+    NAME = "Profile"
+    CHAT_COMMAND = NODE = "profile"
+    HELP = (
+        "Profile the gateway for some time, optionally only the handlers of one "
+        "user, and write the results to the gateway's home directory. "
+        "Usage: profile [SECONDS] [JID]"
+    )
+    ACCESS = CommandAccess.ADMIN_ONLY
+
+    async def run(self, _session, _ifrom, *args: str) -> Union[Form, str]:
+        if args:
+            return self.start({"duration": args[0], "jid": " ".join(args[1:])})
+        return Form(
+            title=self.NAME,
+            instructions=self.HELP,
+            handler=self.finish,  # type:ignore
+            fields=[
+                FormField(
+                    "duration", label="Duration (seconds)", value="30", required=True
+                ),
+                FormField(
+                    "jid",
+                    label="Only profile the handlers of this user (optional)",
+                    type="jid-single",
+                ),
+            ],
+        )
+
+    async def finish(self, form_values: FormValues, _session, _ifrom):
+        return self.start(form_values)
+
+    @staticmethod
+    def start(form_values: FormValues) -> str:
+        try:
+            duration = float(form_values["duration"])  # type:ignore
+        except ValueError:
+            raise XMPPError("bad-request", "The duration must be a number")
+        jid = str(form_values.get("jid") or "") or None
+        try:
+            path = profiling.start(duration, jid)
+        except RuntimeError as e:
+            raise XMPPError("conflict", str(e))
+        return f"Profiling for {duration:.0f}s, the results will be written to {path}"
@@ -1,3 +1,6 @@
+from pathlib import Path
+from typing import Optional
+
 MAX_HISTORY_FETCH = 100
 MAX_HISTORY_FETCH__DOC = (
     "Number of events to fetch to back-fill MUC history before slidge starts up."
@@ -30,3 +33,97 @@ _underline_
 ||spoiler
 \\_escape style_
 """
+
+HTTP_POOL_LIMIT = 0
+HTTP_POOL_LIMIT__DOC = (
+    "Maximum number of simultaneous HTTP connections to a homeserver, shared by "
+    "all users of this homeserver. 0 means no limit. Each logged-in user keeps "
+    "one connection busy for the sync long-polling, so this should be higher "
+    "than the number of users of the homeserver."
+)
+
+HTTP_KEEPALIVE = 60.0
+HTTP_KEEPALIVE__DOC = (
+    "Number of seconds idle HTTP connections to homeservers are kept open for "
+    "re-use."
+)
+
+LOGIN_CONCURRENCY = 10
+LOGIN_CONCURRENCY__DOC = (
+    "Maximum number of users logging in (and doing their initial sync) at the "
+    "same time, e.g. when the gateway starts. Users with an XMPP client online "
+    "are logged in first. 0 means no limit."
+)
+
+SLOW_CALLBACK_THRESHOLD = 1.0
+SLOW_CALLBACK_THRESHOLD__DOC = (
+    "Log a warning when handling a single matrix event takes longer than this "
+    "number of seconds."
+)
+
+METRICS_FILE: Optional[Path] = None
+METRICS_FILE__DOC = (
+    "If set, periodically write metrics about the matrix event handlers "
+    "(calls, errors, latency) to this file, in the prometheus text format."
+)
+
+METRICS_INTERVAL = 60.0
+METRICS_INTERVAL__DOC = "Number of seconds between two writes of METRICS_FILE."
+
+TRACE_SAMPLE_RATE = 0.0
+TRACE_SAMPLE_RATE__DOC = (
+    "Fraction (between 0 and 1) of the messages, corrections, reactions and "
+    "retractions sent from XMPP for which the duration of each step is measured. "
+    "Per-step durations are included in METRICS_FILE."
+)
+
+TRACE_FILE: Optional[Path] = None
+TRACE_FILE__DOC = "If set, append sampled traces to this file, as JSON lines."
+
+SYNC_RECORD_DIR: Optional[Path] = None
+SYNC_RECORD_DIR__DOC = (
+    "If set, record the sync responses of every user to a file in this "
+    "directory, to replay them offline with 'python -m matridge.replay'. "
+    "This is meant for debugging and benchmarking, the files grow quickly."
+)
+
+SYNC_RECORD_ANONYMIZE = True
+SYNC_RECORD_ANONYMIZE__DOC = (
+    "Replace matrix IDs, media URLs and texts in recorded sync responses. "
+    "Encrypted events are recorded as they are, but cannot be decrypted when "
+    "replayed."
+)
+
+LOOP_LAG_THRESHOLD = 0.5
+LOOP_LAG_THRESHOLD__DOC = (
+    "Log a warning, with the user and the handler responsible for it, when the "
+    "event loop shared by all users is blocked for longer than this number of "
+    "seconds. The event loop lag is included in METRICS_FILE. 0 disables the "
+    "event loop monitor."
+)
+
+SESSION_STATS_INTERVAL = 0.0
+SESSION_STATS_INTERVAL__DOC = (
+    "If non-zero, log the number of rooms, cached reactions, running tasks… of "
+    "each user every this many seconds."
+)
+
+EVENT_CACHE_SIZE = 100
+EVENT_CACHE_SIZE__DOC = (
+    "Number of matrix events fetched from the homeserver kept in memory, per "
+    "user. They are used to relate reactions, replies and corrections to their "
+    "target."
+)
+
+ORIGINAL_ID_CACHE_SIZE = 1000
+ORIGINAL_ID_CACHE_SIZE__DOC = (
+    "Number of edited event ID → original event ID resolutions kept in memory, "
+    "per user."
+)
+
+PRESENCE_WINDOW = 1.0
+PRESENCE_WINDOW__DOC = (
+    "Number of seconds during which the matrix presences of a user are "
+    "gathered before forwarding the last one to XMPP. Presences that only "
+    "update the time of the last activity are not forwarded."
+)
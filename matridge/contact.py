@@ -4,6 +4,7 @@ from typing import TYPE_CHECKING, Optional
 
 import nio
 from slidge import LegacyContact, LegacyRoster
+from slixmpp import JID
 from slixmpp.exceptions import XMPPError
 
 if TYPE_CHECKING:
@@ -42,8 +43,8 @@ class Contact(LegacyContact[str]):
 
     def update_presence(self, p: nio.PresenceEvent):
         kw = dict(status=p.status_msg)
-        if last := p.last_active_ago is not None:
-            kw["last_seen"] = datetime.now() - timedelta(seconds=last)
+        if (last := p.last_active_ago) is not None:
+            kw["last_seen"] = datetime.now() - timedelta(milliseconds=last)
         if p.currently_active:
             self.online(**kw)
         else:
@@ -53,6 +54,27 @@ class Contact(LegacyContact[str]):
 class Roster(LegacyRoster[str, Contact]):
     session: "Session"
 
+    def __init__(self, *a, **k):
+        super().__init__(*a, **k)
+        # contacts are all created by by_legacy_id() or by_jid()
+        self.__known = set[str]()
+
+    async def by_legacy_id(self, legacy_id: str, *a, **k) -> Contact:
+        contact = await super().by_legacy_id(legacy_id, *a, **k)
+        self.__known.add(contact.legacy_id)
+        return contact
+
+    async def by_jid(self, contact_jid: JID) -> Contact:
+        contact = await super().by_jid(contact_jid)
+        self.__known.add(contact.legacy_id)
+        return contact
+
+    def is_known(self, legacy_id: str) -> bool:
+        """
+        Whether this contact has already been created, without creating it.
+        """
+        return legacy_id in self.__known
+
     async def jid_username_to_legacy_id(self, jid_username: str):
         u = await super().jid_username_to_legacy_id(jid_username)
         if not u.startswith("@"):
@@ -0,0 +1,118 @@
+import logging
+from contextlib import contextmanager, nullcontext
+from typing import Iterable
+
+from nio.crypto import OlmDevice, TrustState
+from nio.store import DefaultStore, Key, KeyStore
+from peewee import SqliteDatabase
+
+
+class _Database(SqliteDatabase):
+    """
+    nio's model classes are shared by the stores of all users, so nio binds
+    them to the database of a store for the duration of every call, which
+    takes longer than most queries. They are left bound instead, and only
+    bound again when another store has used them in between.
+    """
+
+    def bind_ctx(self, models, bind_refs=True, bind_backrefs=True):
+        if any(model._meta.database is not self for model in models):
+            self.bind(models, bind_refs, bind_backrefs)
+        return nullcontext()
+
+
+class CryptoStore(DefaultStore):
+    """
+    nio's default store, which keeps the trust state of devices in one text
+    file per state, with bulk changes of trust states, and a database tuned
+    for many small writes.
+
+    nio rewrites the whole file for every device whose state changes, and
+    looks devices up in it linearly, which makes changing the state of
+    thousands of devices take minutes.
+
+    nio commits every write to the database separately, and many olm sessions
+    and megolm keys can be written while handling the to-device events of a
+    sync response, blocking the event loop. With :meth:`batch`, they are
+    committed at once.
+    """
+
+    def __post_init__(self):
+        self.__batches = 0
+        self.__transaction = None
+        super().__post_init__()
+
+    def _create_database(self):
+        return _Database(
+            self.database_path,
+            pragmas={
+                # nio's
+                "foreign_keys": 1,
+                "secure_delete": 1,
+                # commits only append to the write-ahead log, and do not wait
+                # for it to reach the disk, which can only lose the last
+                # transactions on power loss, not corrupt the database
+                "journal_mode": "wal",
+                "synchronous": "normal",
+                "temp_store": "memory",
+            },
+        )
+
+    @contextmanager
+    def batch(self):
+        """
+        Make the writes done in this context part of a single transaction,
+        committed when it ends, or rolled back if it ends with an exception.
+
+        Everything written while the transaction is open is part of it, so the
+        context must not wait for anything: olm and megolm sessions used to
+        send messages in the meantime would be lost with it.
+        """
+        if self.__batches == 0:
+            self.__transaction = self.database.atomic()
+            self.__transaction.__enter__()
+        self.__batches += 1
+        error: tuple = (None, None, None)
+        try:
+            yield
+        except BaseException as e:
+            error = type(e), e, e.__traceback__
+            raise
+        finally:
+            self.__batches -= 1
+            if self.__batches == 0:
+                assert self.__transaction is not None
+                self.__transaction.__exit__(*error)
+                self.__transaction = None
+
+    def set_trust_states(
+        self, devices: Iterable[OlmDevice], state: TrustState
+    ) -> list[OlmDevice]:
+        """
+        Change the trust state of devices, writing each file at most once.
+
+        :return: The devices whose state changed
+        """
+        changed = [d for d in devices if d.trust_state != state]
+        if not changed:
+            return []
+        keys = [Key.from_olmdevice(d) for d in changed]
+        files: dict[TrustState, KeyStore] = {
+            TrustState.verified: self.trust_db,
+            TrustState.blacklisted: self.blacklist_db,
+            TrustState.ignored: self.ignore_db,
+        }
+        # first, so that a key whose fingerprint does not match the one already
+        # in the file raises OlmTrustError before the other files are changed
+        if (added := files.pop(state, None)) is not None:
+            added.add_many([k for k in keys if not added.check(k)])
+        for removed in files.values():
+            if old := [k for k in keys if removed.check(k)]:
+                removed.remove_many(old)
+        for device in changed:
+            device.trust_state = state
+        log.debug("%s devices are now %s", len(changed), state.name)
+        return changed
+
+
+log = logging.getLogger(__name__)
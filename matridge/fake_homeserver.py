@@ -0,0 +1,787 @@
+"""
+An in-process, in-memory fake matrix homeserver, implementing (a simplified
+version of) the parts of the client-server API that matridge uses.
+
+It is meant for offline integration, throughput and latency testing: point a
+:class:`matridge.matrix.Client` (or any nio client) at :attr:`FakeHomeserver.url`
+once it is started. The ``register()``, ``create_room()``, ``send()``… methods
+simulate the activity of other matrix users.
+
+No federation, no access control beyond access tokens, no real state
+resolution: it is *not* meant to be a reference implementation.
+"""
+
+import asyncio
+import json
+import time
+from collections import defaultdict
+from typing import Any, Iterable, Optional
+from uuid import uuid4
+
+from aiohttp import web
+
+CLIENT_PREFIXES = ("/_matrix/client/r0", "/_matrix/client/v3")
+MEDIA_PREFIXES = ("/_matrix/media/r0", "/_matrix/media/v3")
+
+
+class FakeRoom:
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        # (stream position, event)
+        self.timeline = list[tuple[int, dict]]()
+        # (type, state_key) → event
+        self.state = dict[tuple[str, str], dict]()
+        self.typing = set[str]()
+        self.typing_pos = 0
+        # (stream position, m.receipt content)
+        self.receipts = list[tuple[int, dict]]()
+
+    def membership(self, user_id: str) -> Optional[str]:
+        event = self.state.get(("m.room.member", user_id))
+        if event is None:
+            return None
+        return event["content"].get("membership")
+
+    @property
+    def members(self) -> list[str]:
+        return [
+            key
+            for (type_, key), event in self.state.items()
+            if type_ == "m.room.member" and event["content"].get("membership") == "join"
+        ]
+
+
+class FakeHomeserver:
+    def __init__(self, server_name="localhost"):
+        self.server_name = server_name
+        self.url = ""
+
+        # user_id → {password, displayname, avatar_url}
+        self.users = dict[str, dict[str, Any]]()
+        # access token → (user_id, device_id)
+        self.tokens = dict[str, tuple[str, str]]()
+        self.rooms = dict[str, FakeRoom]()
+        self.aliases = dict[str, str]()
+        self.events = dict[str, dict]()
+        # media_id → (content type, filename, bytes)
+        self.media = dict[str, tuple[str, Optional[str], bytes]]()
+        # user_id → account data type → content
+        self.account_data = defaultdict[str, dict[str, dict]](dict)
+        self.account_data_pos = defaultdict[str, dict[str, int]](dict)
+        # (stream position, m.presence event)
+        self.presence = list[tuple[int, dict]]()
+        # user_id → device_id → keys
+        self.device_keys = defaultdict[str, dict[str, dict]](dict)
+        self.one_time_keys = defaultdict[tuple[str, str], dict[str, dict]](dict)
+        # (user_id, device_id) → [(stream position, to-device event)]
+        self.to_device = defaultdict[tuple[str, str], list[tuple[int, dict]]](list)
+
+        # number of requests per endpoint, useful in tests
+        self.requests = defaultdict[str, int](int)
+
+        self._pos = 0
+        self._changed = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application(middlewares=[self._middleware])
+        for prefix in CLIENT_PREFIXES:
+            self.__add_client_routes(prefix)
+        for prefix in MEDIA_PREFIXES:
+            self.app.router.add_post(prefix + "/upload", self.upload)
+            self.app.router.add_get(
+                prefix + "/download/{server}/{media_id}", self.download
+            )
+            self.app.router.add_get(
+                prefix + "/download/{server}/{media_id}/{filename}", self.download
+            )
+        self.app.router.add_get("/.well-known/matrix/client", self.well_known)
+
+    def __add_client_routes(self, p: str):
+        r = self.app.router
+        r.add_get(p + "/login", self.login_flows)
+        r.add_post(p + "/login", self.login)
+        r.add_post(p + "/logout", self.logout)
+        r.add_get(p + "/account/whoami", self.whoami)
+        r.add_get(p + "/sync", self.sync)
+        r.add_get(p + "/joined_rooms", self.joined_rooms)
+        r.add_post(p + "/createRoom", self.create_room_endpoint)
+        r.add_post(p + "/join/{room}", self.join)
+        r.add_get(p + "/rooms/{room}/messages", self.room_messages)
+        r.add_put(p + "/rooms/{room}/send/{type}/{txn}", self.room_send)
+        r.add_get(p + "/rooms/{room}/event/{event_id}", self.room_get_event)
+        r.add_put(p + "/rooms/{room}/redact/{event_id}/{txn}", self.room_redact)
+        r.add_put(p + "/rooms/{room}/typing/{user_id}", self.room_typing)
+        r.add_post(p + "/rooms/{room}/receipt/{type}/{event_id}", self.receipt)
+        r.add_get(p + "/rooms/{room}/joined_members", self.joined_members)
+        r.add_get(p + "/rooms/{room}/state", self.room_get_state)
+        r.add_put(p + "/rooms/{room}/state/{type}", self.room_put_state)
+        r.add_put(p + "/rooms/{room}/state/{type}/{state_key}", self.room_put_state)
+        r.add_get(p + "/profile/{user_id}", self.profile)
+        r.add_put(p + "/profile/{user_id}/{field}", self.set_profile)
+        r.add_put(p + "/presence/{user_id}/status", self.put_presence)
+        r.add_get(p + "/user/{user_id}/account_data/{type}", self.get_account_data)
+        r.add_put(p + "/user/{user_id}/account_data/{type}", self.put_account_data)
+        r.add_post(p + "/keys/upload", self.keys_upload)
+        r.add_post(p + "/keys/query", self.keys_query)
+        r.add_post(p + "/keys/claim", self.keys_claim)
+        r.add_put(p + "/sendToDevice/{type}/{txn}", self.send_to_device)
+
+    async def start(self, host="127.0.0.1", port=0) -> str:
+        """
+        Start listening, on a random port by default.
+
+        :return: The URL of the homeserver
+        """
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        assert site._server is not None
+        port = site._server.sockets[0].getsockname()[1]  # type:ignore
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.stop()
+
+    # Simulation of the activity on the homeserver
+
+    def register(
+        self,
+        localpart: str,
+        password="password",
+        displayname: Optional[str] = None,
+        avatar_url: Optional[str] = None,
+    ) -> str:
+        user_id = f"@{localpart}:{self.server_name}"
+        self.users[user_id] = {
+            "password": password,
+            "displayname": displayname or localpart,
+            "avatar_url": avatar_url,
+        }
+        return user_id
+
+    def new_token(self, user_id: str, device_id: Optional[str] = None) -> str:
+        token = uuid4().hex
+        self.tokens[token] = (user_id, device_id or uuid4().hex[:10].upper())
+        return token
+
+    def create_room(
+        self,
+        creator: str,
+        name: Optional[str] = None,
+        topic: Optional[str] = None,
+        members: Iterable[str] = (),
+        encrypted=False,
+        alias: Optional[str] = None,
+    ) -> str:
+        room_id = f"!{uuid4().hex[:18]}:{self.server_name}"
+        self.rooms[room_id] = FakeRoom(room_id)
+        self.set_state(room_id, creator, "m.room.create", {"creator": creator})
+        self.join_room(room_id, creator)
+        self.set_state(
+            room_id,
+            creator,
+            "m.room.power_levels",
+            {"users": {creator: 100}, "users_default": 0},
+        )
+        if name:
+            self.set_state(room_id, creator, "m.room.name", {"name": name})
+        if topic:
+            self.set_state(room_id, creator, "m.room.topic", {"topic": topic})
+        if encrypted:
+            self.set_state(
+                room_id,
+                creator,
+                "m.room.encryption",
+                {"algorithm": "m.megolm.v1.aes-sha2"},
+            )
+        if alias:
+            self.aliases[alias] = room_id
+        for member in members:
+            self.join_room(room_id, member)
+        return room_id
+
+    def join_room(self, room_id: str, user_id: str, membership="join") -> str:
+        profile = self.users.get(user_id, {})
+        content = {"membership": membership}
+        if displayname := profile.get("displayname"):
+            content["displayname"] = displayname
+        if avatar_url := profile.get("avatar_url"):
+            content["avatar_url"] = avatar_url
+        return self.set_state(room_id, user_id, "m.room.member", content, user_id)
+
+    def set_state(
+        self,
+        room_id: str,
+        sender: str,
+        type_: str,
+        content: dict,
+        state_key: str = "",
+    ) -> str:
+        return self.send(room_id, sender, content, type_, state_key=state_key)
+
+    def send(
+        self,
+        room_id: str,
+        sender: str,
+        content: dict,
+        type_: str = "m.room.message",
+        state_key: Optional[str] = None,
+        **extra,
+    ) -> str:
+        room = self.rooms[room_id]
+        event_id = f"${uuid4().hex}"
+        event = {
+            "event_id": event_id,
+            "type": type_,
+            "sender": sender,
+            "room_id": room_id,
+            "origin_server_ts": int(time.time() * 1000),
+            "content": content,
+            "unsigned": {},
+            **extra,
+        }
+        if state_key is not None:
+            event["state_key"] = state_key
+            room.state[(type_, state_key)] = event
+        self.events[event_id] = event
+        room.timeline.append((self.__next_pos(), event))
+        return event_id
+
+    def send_text(self, room_id: str, sender: str, body: str, **content) -> str:
+        return self.send(
+            room_id, sender, {"msgtype": "m.text", "body": body, **content}
+        )
+
+    def react(self, room_id: str, sender: str, event_id: str, key: str) -> str:
+        return self.send(
+            room_id,
+            sender,
+            {
+                "m.relates_to": {
+                    "rel_type": "m.annotation",
+                    "event_id": event_id,
+                    "key": key,
+                }
+            },
+            "m.reaction",
+        )
+
+    def redact(self, room_id: str, sender: str, event_id: str, reason=None) -> str:
+        if target := self.events.get(event_id):
+            target["content"] = {}
+            target["unsigned"]["redacted_because"] = {"sender": sender}
+        content = {"reason": reason} if reason else {}
+        return self.send(room_id, sender, content, "m.room.redaction", redacts=event_id)
+
+    def set_typing(self, room_id: str, user_ids: Iterable[str]):
+        room = self.rooms[room_id]
+        room.typing = set(user_ids)
+        room.typing_pos = self.__next_pos()
+
+    def send_receipt(self, room_id: str, user_id: str, event_id: str):
+        content = {event_id: {"m.read": {user_id: {"ts": int(time.time() * 1000)}}}}
+        self.rooms[room_id].receipts.append((self.__next_pos(), content))
+
+    def set_presence(
+        self,
+        user_id: str,
+        presence="online",
+        status_msg: Optional[str] = None,
+        last_active_ago: Optional[int] = 0,
+    ):
+        content: dict[str, Any] = {
+            "presence": presence,
+            "currently_active": presence == "online",
+        }
+        if status_msg is not None:
+            content["status_msg"] = status_msg
+        if last_active_ago is not None:
+            content["last_active_ago"] = last_active_ago
+        event = {"type": "m.presence", "sender": user_id, "content": content}
+        self.presence.append((self.__next_pos(), event))
+
+    def set_account_data(self, user_id: str, type_: str, content: dict):
+        self.account_data[user_id][type_] = content
+        self.account_data_pos[user_id][type_] = self.__next_pos()
+
+    def __next_pos(self) -> int:
+        self._pos += 1
+        # wake up all pending syncs
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return self._pos
+
+    # HTTP plumbing
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        if request.match_info.route.resource is not None:
+            self.requests[request.match_info.route.resource.canonical] += 1
+        try:
+            return await handler(request)
+        except web.HTTPException as e:
+            if e.status < 400:
+                raise
+            return error(e.status, "M_UNRECOGNIZED", e.reason)
+        except MatrixError as e:
+            return error(e.status, e.errcode, e.message)
+
+    def _auth(self, request: web.Request) -> tuple[str, str]:
+        token = request.query.get("access_token")
+        if token is None:
+            header = request.headers.get("Authorization", "")
+            token = header.removeprefix("Bearer ")
+        try:
+            return self.tokens[token]
+        except KeyError:
+            raise MatrixError(401, "M_UNKNOWN_TOKEN", "Unknown access token")
+
+    def _room(self, request: web.Request, user_id: str) -> FakeRoom:
+        room_id = request.match_info["room"]
+        room_id = self.aliases.get(room_id, room_id)
+        room = self.rooms.get(room_id)
+        if room is None or room.membership(user_id) != "join":
+            raise MatrixError(403, "M_FORBIDDEN", "You are not in this room")
+        return room
+
+    # Endpoints
+
+    async def well_known(self, request: web.Request):
+        return web.json_response({"m.homeserver": {"base_url": self.url}})
+
+    async def login_flows(self, request: web.Request):
+        return web.json_response({"flows": [{"type": "m.login.password"}]})
+
+    async def login(self, request: web.Request):
+        body = await request.json()
+        user = body.get("identifier", {}).get("user") or body.get("user", "")
+        user_id = user if user.startswith("@") else f"@{user}:{self.server_name}"
+        if self.users.get(user_id, {}).get("password") != body.get("password"):
+            raise MatrixError(403, "M_FORBIDDEN", "Invalid password")
+        token = self.new_token(user_id, body.get("device_id"))
+        return web.json_response(
+            {
+                "user_id": user_id,
+                "access_token": token,
+                "device_id": self.tokens[token][1],
+            }
+        )
+
+    async def logout(self, request: web.Request):
+        self._auth(request)
+        self.tokens.pop(request.query.get("access_token", ""), None)
+        return web.json_response({})
+
+    async def whoami(self, request: web.Request):
+        user_id, device_id = self._auth(request)
+        return web.json_response({"user_id": user_id, "device_id": device_id})
+
+    async def sync(self, request: web.Request):
+        user_id, device_id = self._auth(request)
+        since = int(request.query.get("since", 0))
+        full_state = request.query.get("full_state") == "true" or not since
+        timeout = int(request.query.get("timeout", 0)) / 1000
+        filt = parse_filter(request.query.get("filter"))
+
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self._changed
+            response, new = self.__sync_response(
+                user_id, device_id, since, full_state, filt
+            )
+            remaining = deadline - time.monotonic()
+            if new or full_state or remaining <= 0:
+                return web.json_response(response)
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def __sync_response(
+        self, user_id: str, device_id: str, since: int, full_state: bool, filt: dict
+    ) -> tuple[dict, bool]:
+        new = False
+        join = {}
+        timeline_filter = filt.get("room", {}).get("timeline", {})
+        limit = timeline_filter.get("limit", 100)
+        for room in self.rooms.values():
+            if room.membership(user_id) != "join":
+                continue
+            timeline = [
+                (pos, e)
+                for pos, e in room.timeline
+                if pos > since and match_filter(e, timeline_filter)
+            ]
+            limited = len(timeline) > limit
+            timeline = timeline[-limit:] if limit else []
+            events = [e for _, e in timeline]
+            prev_batch = timeline[0][0] - 1 if timeline else self._pos
+            ephemeral = []
+            if room.typing_pos > since:
+                ephemeral.append(
+                    {"type": "m.typing", "content": {"user_ids": sorted(room.typing)}}
+                )
+            receipts = [content for pos, content in room.receipts if pos > since]
+            if receipts:
+                merged: dict[str, Any] = {}
+                for content in receipts:
+                    for event_id, receipt in content.items():
+                        for type_, users in receipt.items():
+                            merged.setdefault(event_id, {}).setdefault(
+                                type_, {}
+                            ).update(users)
+                ephemeral.append({"type": "m.receipt", "content": merged})
+            state = list(room.state.values()) if full_state else []
+            if not (events or ephemeral or state):
+                continue
+            new = new or bool(events or ephemeral)
+            join[room.room_id] = {
+                "timeline": {
+                    "events": events,
+                    "limited": limited,
+                    "prev_batch": str(prev_batch),
+                },
+                "state": {"events": state},
+                "ephemeral": {"events": ephemeral},
+                "summary": {"m.joined_member_count": len(room.members)},
+            }
+
+        shared = {
+            u for r in self.rooms.values() for u in r.members if user_id in r.members
+        }
+        presence = [
+            e for pos, e in self.presence if pos > since and e["sender"] in shared
+        ]
+        account_data = [
+            {"type": t, "content": content}
+            for t, content in self.account_data[user_id].items()
+            if self.account_data_pos[user_id][t] > since
+        ]
+        to_device = [
+            e for pos, e in self.to_device[(user_id, device_id)] if pos > since
+        ]
+        new = new or bool(presence or account_data or to_device)
+        response = {
+            "next_batch": str(self._pos),
+            "rooms": {"join": join, "invite": {}, "leave": {}},
+            "presence": {"events": presence},
+            "account_data": {"events": account_data},
+            "to_device": {"events": to_device},
+            "device_one_time_keys_count": {
+                "signed_curve25519": len(self.one_time_keys[(user_id, device_id)])
+            },
+        }
+        return response, new
+
+    async def joined_rooms(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        return web.json_response(
+            {
+                "joined_rooms": [
+                    r.room_id
+                    for r in self.rooms.values()
+                    if r.membership(user_id) == "join"
+                ]
+            }
+        )
+
+    async def create_room_endpoint(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        body = await request.json()
+        room_id = self.create_room(
+            user_id, name=body.get("name"), topic=body.get("topic")
+        )
+        for invitee in body.get("invite", []):
+            self.join_room(room_id, invitee, "invite")
+        return web.json_response({"room_id": room_id})
+
+    async def join(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room_id = request.match_info["room"]
+        room_id = self.aliases.get(room_id, room_id)
+        if room_id not in self.rooms:
+            raise MatrixError(404, "M_NOT_FOUND", "No such room")
+        self.join_room(room_id, user_id)
+        return web.json_response({"room_id": room_id})
+
+    async def room_messages(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        start = int(request.query.get("from") or self._pos)
+        forward = request.query.get("dir") == "f"
+        limit = int(request.query.get("limit", 10))
+        filt = parse_filter(request.query.get("filter"))
+
+        if forward:
+            candidates = [(p, e) for p, e in room.timeline if p > start]
+        else:
+            candidates = [(p, e) for p, e in reversed(room.timeline) if p <= start]
+        chunk = list[tuple[int, dict]]()
+        for pos, event in candidates:
+            if len(chunk) >= limit:
+                break
+            if match_filter(event, filt):
+                chunk.append((pos, event))
+
+        response: dict[str, Any] = {
+            "chunk": [e for _, e in chunk],
+            "start": str(start),
+        }
+        if chunk:
+            last = chunk[-1][0]
+            response["end"] = str(last if forward else last - 1)
+        return web.json_response(response)
+
+    async def room_send(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        event_id = self.send(
+            room.room_id, user_id, await request.json(), request.match_info["type"]
+        )
+        return web.json_response({"event_id": event_id})
+
+    async def room_get_event(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        event = self.events.get(request.match_info["event_id"])
+        if event is None or event["room_id"] != room.room_id:
+            raise MatrixError(404, "M_NOT_FOUND", "Event not found")
+        return web.json_response(event)
+
+    async def room_redact(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        body = await request.json()
+        event_id = self.redact(
+            room.room_id, user_id, request.match_info["event_id"], body.get("reason")
+        )
+        return web.json_response({"event_id": event_id})
+
+    async def room_typing(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        body = await request.json()
+        typing = set(room.typing)
+        if body.get("typing"):
+            typing.add(user_id)
+        else:
+            typing.discard(user_id)
+        if typing != room.typing:
+            self.set_typing(room.room_id, typing)
+        return web.json_response({})
+
+    async def receipt(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        self.send_receipt(room.room_id, user_id, request.match_info["event_id"])
+        return web.json_response({})
+
+    async def joined_members(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        joined = {}
+        for member in room.members:
+            content = room.state[("m.room.member", member)]["content"]
+            joined[member] = {
+                "display_name": content.get("displayname"),
+                "avatar_url": content.get("avatar_url"),
+            }
+        return web.json_response({"joined": joined})
+
+    async def room_get_state(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        return web.json_response(list(room.state.values()))
+
+    async def room_put_state(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        room = self._room(request, user_id)
+        event_id = self.set_state(
+            room.room_id,
+            user_id,
+            request.match_info["type"],
+            await request.json(),
+            request.match_info.get("state_key", ""),
+        )
+        return web.json_response({"event_id": event_id})
+
+    async def profile(self, request: web.Request):
+        user = self.users.get(request.match_info["user_id"])
+        if user is None:
+            raise MatrixError(404, "M_NOT_FOUND", "Profile not found")
+        profile = {"displayname": user["displayname"]}
+        if user["avatar_url"]:
+            profile["avatar_url"] = user["avatar_url"]
+        return web.json_response(profile)
+
+    async def set_profile(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        field = request.match_info["field"]
+        if field not in ("displayname", "avatar_url"):
+            raise MatrixError(404, "M_UNRECOGNIZED", "Unknown profile field")
+        self.users[user_id][field] = (await request.json()).get(field)
+        return web.json_response({})
+
+    async def put_presence(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        body = await request.json()
+        self.set_presence(user_id, body.get("presence"), body.get("status_msg"))
+        return web.json_response({})
+
+    async def get_account_data(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        content = self.account_data[user_id].get(request.match_info["type"])
+        if content is None:
+            raise MatrixError(404, "M_NOT_FOUND", "Account data not found")
+        return web.json_response(content)
+
+    async def put_account_data(self, request: web.Request):
+        user_id, _ = self._auth(request)
+        self.set_account_data(user_id, request.match_info["type"], await request.json())
+        return web.json_response({})
+
+    async def keys_upload(self, request: web.Request):
+        user_id, device_id = self._auth(request)
+        body = await request.json()
+        if device_keys := body.get("device_keys"):
+            self.device_keys[user_id][device_id] = device_keys
+        otks = self.one_time_keys[(user_id, device_id)]
+        otks.update(body.get("one_time_keys", {}))
+        return web.json_response(
+            {"one_time_key_counts": {"signed_curve25519": len(otks)}}
+        )
+
+    async def keys_query(self, request: web.Request):
+        self._auth(request)
+        body = await request.json()
+        device_keys = {}
+        for user_id, devices in body.get("device_keys", {}).items():
+            known = self.device_keys.get(user_id, {})
+            device_keys[user_id] = {
+                d: k for d, k in known.items() if not devices or d in devices
+            }
+        return web.json_response({"device_keys": device_keys, "failures": {}})
+
+    async def keys_claim(self, request: web.Request):
+        self._auth(request)
+        body = await request.json()
+        claimed: dict[str, dict] = {}
+        for user_id, devices in body.get("one_time_keys", {}).items():
+            for device_id in devices:
+                otks = self.one_time_keys[(user_id, device_id)]
+                if otks:
+                    key_id = next(iter(otks))
+                    claimed.setdefault(user_id, {})[device_id] = {
+                        key_id: otks.pop(key_id)
+                    }
+        return web.json_response({"one_time_keys": claimed, "failures": {}})
+
+    async def send_to_device(self, request: web.Request):
+        sender, _ = self._auth(request)
+        body = await request.json()
+        type_ = request.match_info["type"]
+        for user_id, devices in body.get("messages", {}).items():
+            if "*" in devices:
+                devices = {d: devices["*"] for d in self.device_keys[user_id]}
+            for device_id, content in devices.items():
+                event = {"type": type_, "sender": sender, "content": content}
+                self.to_device[(user_id, device_id)].append((self.__next_pos(), event))
+        return web.json_response({})
+
+    async def upload(self, request: web.Request):
+        self._auth(request)
+        media_id = uuid4().hex
+        self.media[media_id] = (
+            request.content_type,
+            request.query.get("filename"),
+            await request.read(),
+        )
+        return web.json_response(
+            {"content_uri": f"mxc://{self.server_name}/{media_id}"}
+        )
+
+    async def download(self, request: web.Request):
+        media = self.media.get(request.match_info["media_id"])
+        if media is None:
+            raise MatrixError(404, "M_NOT_FOUND", "Media not found")
+        content_type, filename, data = media
+        headers = {}
+        if filename:
+            headers["Content-Disposition"] = f'inline; filename="{filename}"'
+        return web.Response(body=data, content_type=content_type, headers=headers)
+
+
+class MatrixError(Exception):
+    def __init__(self, status: int, errcode: str, message: str):
+        self.status = status
+        self.errcode = errcode
+        self.message = message
+
+
+def error(status: int, errcode: str, message: str):
+    return web.json_response({"errcode": errcode, "error": message}, status=status)
+
+
+def parse_filter(raw: Optional[str]) -> dict:
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        # a filter ID, we do not implement uploading filters
+        return {}
+
+
+def match_filter(event: dict, filt: dict) -> bool:
+    """
+    Apply the (flat) event filter part of a matrix filter, ie the one that
+    room_messages() expect, or what is under room.timeline for sync().
+    """
+    if (types := filt.get("types")) is not None and event["type"] not in types:
+        return False
+    if event["type"] in filt.get("not_types", ()):
+        return False
+    if (senders := filt.get("senders")) is not None and event["sender"] not in senders:
+        return False
+    if event["sender"] in filt.get("not_senders", ()):
+        return False
+    return True
+
+
+async def serve(host: str, port: int, users: list[str]):
+    server = FakeHomeserver()
+    for user in users:
+        server.register(user)
+    print("Listening on", await server.start(host, port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake matrix homeserver.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument(
+        "--user",
+        action="append",
+        default=[],
+        help="Register a user with this localpart and 'password' as password. "
+        "Can be repeated.",
+    )
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.user))
@@ -1,12 +1,18 @@
 import logging
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 from nio.responses import LoginError
-from slidge import BaseGateway, FormField, GatewayUser, global_config
+from slidge import BaseGateway, FormField, GatewayUser, global_config, user_store
 from slixmpp import JID
 
 from . import config
 from .matrix import AuthenticationClient
+from .metrics import metrics
+from .monitor import LoopMonitor, log_session_stats_forever
+from .startup import LoginScheduler
+
+if TYPE_CHECKING:
+    from .session import Session
 
 
 class Gateway(BaseGateway):
@@ -43,11 +49,40 @@ class Gateway(BaseGateway):
 
     def __init__(self):
         super().__init__()
+        self.login_scheduler = LoginScheduler(config.LOGIN_CONCURRENCY)
+        # bare JID → session, as created by slidge when needed
+        self.__sessions = dict[str, "Session"]()
+        if config.METRICS_FILE:
+            self.loop.create_task(
+                metrics.write_forever(config.METRICS_FILE, config.METRICS_INTERVAL)
+            )
+        self.loop_monitor: Optional[LoopMonitor] = None
+        if config.LOOP_LAG_THRESHOLD:
+            self.loop_monitor = LoopMonitor(config.LOOP_LAG_THRESHOLD)
+            self.loop.create_task(self.loop_monitor.run())
+        if config.SESSION_STATS_INTERVAL:
+            self.loop.create_task(
+                log_session_stats_forever(self.sessions, config.SESSION_STATS_INTERVAL)
+            )
         if config.NIO_SILENT:
             logging.getLogger("peewee").setLevel(logging.WARNING)
             logging.getLogger("nio.responses").setLevel(logging.WARNING)
             logging.getLogger("nio.rooms").setLevel(logging.WARNING)
 
+    def add_session(self, session: "Session"):
+        self.__sessions[session.user.bare_jid] = session
+
+    def sessions(self) -> list["Session"]:
+        """
+        The sessions of the registered users, without creating those that do
+        not exist yet.
+        """
+        return [
+            session
+            for user in user_store.get_all()
+            if (session := self.__sessions.get(user.bare_jid)) is not None
+        ]
+
     async def validate(
         self, user_jid: JID, registration_form: dict[str, Optional[str]]
     ):
@@ -56,11 +91,14 @@ class Gateway(BaseGateway):
             registration_form["username"],  # type:ignore
             user_jid,
         )
-        await client.fix_homeserver()
-        resp = await client.login(
-            registration_form["password"],  # type:ignore
-            registration_form["device"],  # type:ignore
-        )
+        try:
+            await client.fix_homeserver()
+            resp = await client.login(
+                registration_form["password"],  # type:ignore
+                registration_form["device"],  # type:ignore
+            )
+        finally:
+            await client.close()
         if isinstance(resp, LoginError):
             log.debug("Failed login: %r", resp)
             raise PermissionError(resp)
@@ -71,6 +109,7 @@ class Gateway(BaseGateway):
         resp = await session.matrix.logout()  # type: ignore
         log.debug("Logout response: %s", resp)
         session.matrix.destroy()  # type: ignore
+        self.__sessions.pop(user.bare_jid, None)
 
 
 log = logging.getLogger(__name__)
@@ -2,6 +2,7 @@ import typing
 
 import nio
 from slidge import LegacyBookmarks, LegacyMUC, LegacyParticipant, MucType
+from slixmpp import JID
 from slixmpp.exceptions import XMPPError
 
 from . import config
@@ -19,6 +20,28 @@ class Participant(MatrixMixin, LegacyParticipant):
 class Bookmarks(LegacyBookmarks):
     session: "Session"
 
+    def __init__(self, *a, **k):
+        super().__init__(*a, **k)
+        # MUCs are all created by by_legacy_id() or by_jid()
+        self.__known = dict[str, "MUC"]()
+
+    async def by_legacy_id(self, legacy_id: str) -> "MUC":
+        return self.__add(await super().by_legacy_id(legacy_id))
+
+    async def by_jid(self, jid: JID) -> "MUC":
+        return self.__add(await super().by_jid(jid))
+
+    def __add(self, muc: "MUC") -> "MUC":
+        if muc.legacy_id not in self.__known:
+            self.__known[muc.legacy_id] = muc
+            self.session.matrix.forget_participants()
+        return muc
+
+    def remove(self, muc: LegacyMUC):
+        super().remove(muc)
+        if self.__known.pop(muc.legacy_id, None) is not None:
+            self.session.matrix.forget_participants()
+
     async def fill(self):
         self.log.debug("Filling rooms")
         for room in self.session.matrix.rooms:
@@ -29,6 +52,13 @@ class Bookmarks(LegacyBookmarks):
                     "%s is not a group chat or trouble getting it: %r", room, e
                 )
 
+    def get_known(self, legacy_id: str) -> typing.Optional["MUC"]:
+        """
+        The MUC for this room if it has already been created, without
+        creating it.
+        """
+        return self.__known.get(legacy_id)
+
 
 class MUC(LegacyMUC[str, str, Participant, str]):
     session: "Session"
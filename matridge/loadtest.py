@@ -0,0 +1,415 @@
+"""
+Load test harness: run many matridge sessions in a single process against
+:class:`matridge.fake_homeserver.FakeHomeserver` and report throughput,
+latency, event loop lag and memory usage over time.
+
+Each simulated user is logged in to the gateway with a session of its own, and
+is a member of several rooms, each having a "remote" matrix user in it. The
+remote users send messages, reactions and typing notifications at the
+requested rates, and the XMPP users send messages to the rooms. XMPP stanzas
+produced by the gateway are discarded.
+
+Inbound latency is measured from the moment the fake homeserver receives an
+event to the moment matridge has finished handling it (ie, sent the
+corresponding stanzas), using an extra nio callback registered after the
+matridge ones. Outbound latency is the duration of ``Session.send_text()``.
+
+Usage::
+
+    python -m matridge.loadtest --users 20 --rooms 5 --messages 50 --duration 60
+
+Note that the fake homeserver runs in the same process and event loop, so it
+contributes to the CPU usage, the loop lag and the RSS.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import nio
+from slidge import user_store
+from slidge.core import config as global_config
+from slidge.core.cache import avatar_cache
+from slixmpp import JID
+
+from .fake_homeserver import FakeHomeserver
+from .gateway import Gateway
+from .group import MUC
+from .session import Session
+
+
+class NullTransport:
+    """
+    Stands in for the connection to the XMPP server, only counting what the
+    gateway sends.
+    """
+
+    def __init__(self):
+        self.stanzas = 0
+        self.bytes = 0
+
+    def write(self, data: bytes):
+        self.stanzas += 1
+        self.bytes += len(data)
+
+    def get_extra_info(self, *_a, **_kw):
+        return None
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss() -> int:
+    """
+    Current resident set size in bytes, or the peak one where /proc is not
+    available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Stats:
+    """
+    Measurements since the last report.
+    """
+
+    def __init__(self):
+        self.inbound = list[float]()
+        self.outbound = list[float]()
+        self.lag = list[float]()
+        self.typing = 0
+        self.errors = 0
+
+    def report(self, elapsed: float, interval: float, stanzas: int) -> dict[str, Any]:
+        return {
+            "elapsed": round(elapsed, 1),
+            "inbound_per_s": len(self.inbound) / interval,
+            "typing_per_s": self.typing / interval,
+            "outbound_per_s": len(self.outbound) / interval,
+            "stanzas_per_s": stanzas / interval,
+            "inbound_p50_ms": percentile(self.inbound, 0.5) * 1000,
+            "inbound_p99_ms": percentile(self.inbound, 0.99) * 1000,
+            "outbound_p50_ms": percentile(self.outbound, 0.5) * 1000,
+            "outbound_p99_ms": percentile(self.outbound, 0.99) * 1000,
+            "lag_p99_ms": percentile(self.lag, 0.99) * 1000,
+            "lag_max_ms": max(self.lag, default=0) * 1000,
+            "errors": self.errors,
+            "rss_mb": rss() / 2**20,
+        }
+
+
+def setup_gateway(home: Path, transport: NullTransport) -> Gateway:
+    """
+    Create a gateway "connected" to ``transport``, storing its data in ``home``.
+    """
+    global_config.JID = JID("matrix.localhost")
+    global_config.SECRET = "secret"
+    global_config.SERVER = "localhost"
+    global_config.HOME_DIR = home
+    global_config.USER_JID_VALIDATOR = ".*"
+    global_config.NO_ROSTER_PUSH = True
+    global_config.UPLOAD_SERVICE = "upload.localhost"
+    global_config.UPLOAD_REQUESTER = "matrix.localhost"
+    user_store.set_file(home / "slidge.db")
+    avatar_cache.set_dir(home / "avatars")
+
+    xmpp = Gateway()
+    avatar_cache.http = xmpp.http
+    xmpp.connection_made(transport)  # type:ignore
+    xmpp.session_bind_event.set()
+    xmpp.data_received(xmpp.stream_header.encode())
+    # what XMLStream.connect() and the session start would do, without
+    # triggering slidge's startup routine
+    xmpp._always_send_everything = True
+    xmpp._run_out_filters = asyncio.create_task(xmpp.run_filters())
+    return xmpp
+
+
+async def log_in(xmpp: Gateway, homeserver: FakeHomeserver, username: str) -> Session:
+    """
+    Register ``username`` (who must exist on the homeserver) to the gateway and
+    log them in, as slidge would when they come online.
+    """
+    jid = JID(f"{username}@localhost")
+    form: dict[str, Optional[str]] = {
+        "homeserver": homeserver.url,
+        "username": username,
+        "password": "password",
+        "device": username,
+    }
+    await xmpp.validate(jid, form)
+    user_store.add(jid, form)
+    user = user_store.get_by_jid(jid)
+    assert user is not None
+    session: Session = xmpp.session_cls.from_user(user)  # type:ignore
+    await session.login()
+    session.logged = True
+    await session.contacts.fill()
+    session.contacts.ready.set_result(True)
+    await session.bookmarks.fill()
+    session.bookmarks.ready.set_result(True)
+    return session
+
+
+def join(xmpp: Gateway, session: Session, muc: MUC):
+    """
+    Join a MUC from XMPP, or else slidge does not send anything from it.
+    """
+    xmpp.data_received(
+        f"<presence from='{session.user.jid}/loadtest' to='{muc.jid}/nick'>"
+        "<x xmlns='http://jabber.org/protocol/muc' /></presence>".encode()
+    )
+
+
+class LoadTest:
+    def __init__(
+        self,
+        users: int,
+        rooms: int,
+        messages: float,
+        reactions: float,
+        typing: float,
+        sends: float,
+    ):
+        """
+        :param users: Number of XMPP users, each with its own session
+        :param rooms: Number of matrix rooms per user
+        :param messages: Inbound messages per second, for all users
+        :param reactions: Inbound reactions per second, for all users
+        :param typing: Inbound typing notifications per second, for all users
+        :param sends: Messages sent from XMPP per second, for all users
+        """
+        self.n_users = users
+        self.n_rooms = rooms
+        self.rates = {
+            self.__message: messages,
+            self.__reaction: reactions,
+            self.__typing: typing,
+            self.__send: sends,
+        }
+        self.homeserver = FakeHomeserver()
+        self.transport = NullTransport()
+        self.xmpp: Optional[Gateway] = None
+        self.sessions = list[Session]()
+        # (session, room_id, remote user mxid)
+        self.rooms = list[tuple[Session, str, str]]()
+        self.last_event = dict[str, str]()
+        # event_id → time.perf_counter() when the homeserver received it
+        self.pending = dict[str, float]()
+        self.stats = Stats()
+        self.__tasks = list[asyncio.Task]()
+
+    async def __login(self, i: int, xmpp: Gateway):
+        mxid = self.homeserver.register(f"user{i}")
+        rooms = []
+        for j in range(self.n_rooms):
+            remote = self.homeserver.register(f"remote{i}-{j}")
+            room_id = self.homeserver.create_room(
+                remote, name=f"Room {i}-{j}", members=[mxid]
+            )
+            rooms.append((room_id, remote))
+
+        session = await log_in(xmpp, self.homeserver, f"user{i}")
+        session.matrix.add_event_callback(
+            self.__on_event, (nio.RoomMessage, nio.ReactionEvent)
+        )
+        session.matrix.add_ephemeral_callback(self.__on_typing, nio.TypingNoticeEvent)
+
+        self.sessions.append(session)
+        for room_id, remote in rooms:
+            self.rooms.append((session, room_id, remote))
+            join(xmpp, session, await session.bookmarks.by_legacy_id(room_id))
+
+    async def __on_event(self, _room, event: nio.Event):
+        if (start := self.pending.pop(event.event_id, None)) is not None:
+            self.stats.inbound.append(time.perf_counter() - start)
+
+    async def __on_typing(self, _room, _event):
+        self.stats.typing += 1
+
+    def __message(self):
+        _, room_id, remote = random.choice(self.rooms)
+        event_id = self.homeserver.send_text(room_id, remote, "Some text")
+        self.pending[event_id] = time.perf_counter()
+        self.last_event[room_id] = event_id
+
+    def __reaction(self):
+        _, room_id, remote = random.choice(self.rooms)
+        target = self.last_event.get(room_id)
+        if target is None:
+            return
+        event_id = self.homeserver.react(room_id, remote, target, random.choice("👍❤️😂"))
+        self.pending[event_id] = time.perf_counter()
+
+    def __typing(self):
+        _, room_id, remote = random.choice(self.rooms)
+        typing = self.homeserver.rooms[room_id].typing
+        self.homeserver.set_typing(room_id, [] if remote in typing else [remote])
+
+    def __send(self):
+        asyncio.create_task(self.__send_text(*random.choice(self.rooms)))
+
+    async def __send_text(self, session: Session, room_id: str, _remote: str):
+        muc: MUC = await session.bookmarks.by_legacy_id(room_id)
+        start = time.perf_counter()
+        try:
+            await session.send_text(muc, "Some text")
+        except Exception as e:
+            log.debug("Could not send", exc_info=e)
+            self.stats.errors += 1
+        else:
+            self.stats.outbound.append(time.perf_counter() - start)
+
+    async def __drive(self, action, rate: float):
+        interval = 1 / rate
+        next_time = time.perf_counter()
+        while True:
+            action()
+            # catch up if we are late, so that the actual rate matches the
+            # requested one as long as the loop can keep up
+            next_time += interval
+            await asyncio.sleep(max(0.0, next_time - time.perf_counter()))
+
+    async def __monitor_lag(self, interval=0.05):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.stats.lag.append(time.perf_counter() - start - interval)
+
+    async def run(self, duration: float, report_interval: float):
+        """
+        Yield a report every ``report_interval`` seconds.
+        """
+        with tempfile.TemporaryDirectory(prefix="matridge-loadtest-") as home:
+            reports = self.__run(Path(home), duration, report_interval)
+            try:
+                async for report in reports:
+                    yield report
+            finally:
+                # stops the sessions before their data is removed
+                await reports.aclose()
+
+    async def __run(self, home: Path, duration: float, report_interval: float):
+        self.xmpp = xmpp = setup_gateway(home, self.transport)
+        await self.homeserver.start("127.0.0.1")
+
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(self.__login(i, xmpp) for i in range(self.n_users)))
+            yield {
+                "logged_in": len(self.sessions),
+                "login_s": time.perf_counter() - start,
+                "rss_mb": rss() / 2**20,
+            }
+
+            self.__tasks.append(asyncio.create_task(self.__monitor_lag()))
+            for action, rate in self.rates.items():
+                if rate > 0:
+                    self.__tasks.append(asyncio.create_task(self.__drive(action, rate)))
+
+            start = time.perf_counter()
+            stanzas = self.transport.stanzas
+            self.stats = Stats()
+            while (elapsed := time.perf_counter() - start) < duration:
+                await asyncio.sleep(report_interval)
+                elapsed = time.perf_counter() - start
+                report = self.stats.report(
+                    elapsed, report_interval, self.transport.stanzas - stanzas
+                )
+                # events sent by the homeserver but not handled yet
+                report["pending_events"] = len(self.pending)
+                # stanzas waiting for slixmpp's (sequential) outgoing filters
+                report["pending_stanzas"] = xmpp.waiting_queue.qsize()
+                yield report
+                stanzas = self.transport.stanzas
+                self.stats = Stats()
+        finally:
+            await self.stop()
+            user_store.close()
+
+    async def stop(self):
+        for task in self.__tasks:
+            task.cancel()
+        if self.xmpp is not None and self.xmpp._run_out_filters is not None:
+            self.xmpp._run_out_filters.cancel()
+        for session in self.sessions:
+            session.matrix.stop_listen()
+            await session.matrix.close()
+            session.matrix.event_store.close()
+        await self.homeserver.stop()
+
+
+async def main(args: argparse.Namespace):
+    test = LoadTest(
+        args.users, args.rooms, args.messages, args.reactions, args.typing, args.sends
+    )
+    output = open(args.output, "a") if args.output else None
+    try:
+        async for report in test.run(args.duration, args.interval):
+            if output:
+                output.write(json.dumps(report) + "\n")
+                output.flush()
+            print(
+                " ".join(
+                    f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+                    for k, v in report.items()
+                )
+            )
+    finally:
+        if output:
+            output.close()
+
+
+log = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run matridge sessions against a fake homeserver and report "
+        "throughput, latency, event loop lag and memory usage."
+    )
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--rooms", type=int, default=5, help="Rooms per user")
+    parser.add_argument(
+        "--messages", type=float, default=20, help="Inbound messages per second"
+    )
+    parser.add_argument(
+        "--reactions", type=float, default=5, help="Inbound reactions per second"
+    )
+    parser.add_argument(
+        "--typing",
+        type=float,
+        default=5,
+        help="Inbound typing notifications per second",
+    )
+    parser.add_argument(
+        "--sends", type=float, default=5, help="Messages sent from XMPP per second"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="In seconds")
+    parser.add_argument(
+        "--interval", type=float, default=5, help="Seconds between reports"
+    )
+    parser.add_argument("--output", type=Path, help="Append JSON lines reports here")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    asyncio.run(main(args))
@@ -1,27 +1,54 @@
+import itertools
 import json
 import logging
 import shutil
 import time
 from asyncio import Task, create_task, sleep
-from functools import wraps
-from typing import TYPE_CHECKING, Awaitable, Callable, Optional, TypedDict, Union
+from contextlib import nullcontext
+from functools import partial, wraps
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Iterable,
+    Optional,
+    TypedDict,
+    Union,
+)
+from urllib.parse import urlparse
 
 import nio
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
 from async_lru import alru_cache
+from nio.client.async_client import connect_wrapper, on_request_chunk_sent
+from nio.crypto import OlmDevice, TrustState
 from slidge.core import config as global_config
 from slidge.util.types import LegacyAttachment
 from slixmpp import JID
 from slixmpp.exceptions import XMPPError
 
 from . import config
+from .crypto_store import CryptoStore
+from .metrics import metrics
+from .monitor import entry_point
+from .presence import PresenceCoalescer
+from .profiling import profiled
 from .reactions import ReactionCache
-from .util import get_replace, server_timestamp_to_datetime
+from .record import SyncRecorder
+from .store import EventStore, StoredMessage
+from .tracing import span
+from .util import get_rel, get_replace, server_timestamp_to_datetime
 
 if TYPE_CHECKING:
     from .group import MUC, Participant
     from .session import Session
 
 
+MetadataEvent = Union[nio.RoomAvatarEvent, nio.RoomTopicEvent, nio.RoomNameEvent]
+
+
 def catch_all(coro: Callable[["Client", nio.MatrixRoom, nio.Event], Awaitable[None]]):
     @wraps(coro)
     async def wrapped(self: "Client", room: nio.MatrixRoom, event: nio.Event, *a, **kw):
@@ -29,18 +56,80 @@ def catch_all(coro: Callable[["Client", nio.MatrixRoom, nio.Event], Awaitable[No
         if event_id in self.session.events_to_ignore:
             self.log.debug("Ignoring an event matridge has sent: %s", event_id)
             return
+        error = False
+        start = time.perf_counter()
         try:
             return await coro(self, room, event, *a, **kw)
         except XMPPError as e:
+            error = True
             self.log.debug(
                 "Exception raised in matrix client callback %s", coro, exc_info=e
             )
         except Exception as e:
+            error = True
             self.log.exception(
                 "Exception raised in matrix client callback %s", coro, exc_info=e
             )
+        finally:
+            duration = time.perf_counter() - start
+            metrics.observe_handler(coro.__name__, duration, error)
+            if duration > config.SLOW_CALLBACK_THRESHOLD:
+                self.log.warning(
+                    "Matrix client callback %s took %.2fs for %s",
+                    coro.__name__,
+                    duration,
+                    event_id,
+                )
+            if not error and (ts := getattr(event, "server_timestamp", None)):
+                metrics.observe_delivery(time.time() - ts / 1000)
+
+    return profiled(entry_point(wrapped))
+
+
+class instance_cache:
+    """
+    Like :func:`alru_cache` but with one cache per instance, so that they do
+    not keep each other alive, and with a size read from the config when
+    first used.
+    """
+
+    def __init__(self, maxsize: Callable[[], int]):
+        self.maxsize = maxsize
+
+    def __call__(self, func):
+        self.func = func
+        return self
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        # stored in the instance's __dict__, which takes precedence over this
+        # (non-data) descriptor from now on
+        cache = obj.__dict__[self.name] = alru_cache(maxsize=self.maxsize())(
+            partial(self.func, obj)
+        )
+        return cache
+
+
+def get_connector(homeserver: str) -> TCPConnector:
+    """
+    Get the HTTP connection pool shared by all clients of a homeserver.
 
-    return wrapped
+    It is created on first use, so this must be called from a running event loop.
+    """
+    key = urlparse(homeserver).netloc
+    connector = _connectors.get(key)
+    if connector is None or connector.closed:
+        connector = _connectors[key] = TCPConnector(
+            limit=config.HTTP_POOL_LIMIT,
+            keepalive_timeout=config.HTTP_KEEPALIVE,
+        )
+        # same as what nio does for its own client sessions
+        connector.connect = partial(connect_wrapper, connector)  # type:ignore
+    return connector
 
 
 class Credentials(TypedDict):
@@ -51,6 +140,8 @@ class Credentials(TypedDict):
 
 
 class AuthenticationClient(nio.AsyncClient):
+    homeserver: str
+
     def __init__(
         self, server: str, handle: str, jid: JID, log: Optional[logging.Logger] = None
     ):
@@ -64,13 +155,27 @@ class AuthenticationClient(nio.AsyncClient):
             max_limit_exceeded=0,
             max_timeouts=0,
             encryption_enabled=True,
+            store=CryptoStore,
         )
         super().__init__(server, handle, store_path=str(store_path), config=cfg)
+        self.client_session = self.__create_client_session()
         if log:
             self.log = log
         else:
             self.log = logging.getLogger(__name__)
 
+    def __create_client_session(self) -> ClientSession:
+        # nio would create a session with its own connector on the first
+        # request, we make it use the pool shared with the other users instead
+        trace = TraceConfig()
+        trace.on_request_chunk_sent.append(on_request_chunk_sent)
+        return ClientSession(
+            timeout=ClientTimeout(total=self.config.request_timeout),
+            trace_configs=[trace],
+            connector=get_connector(self.homeserver),
+            connector_owner=False,
+        )
+
     def save(self, resp: nio.LoginResponse):
         creds: Credentials = {
             "homeserver": self.homeserver,
@@ -107,10 +212,33 @@ class AuthenticationClient(nio.AsyncClient):
         """
         Uses https://$HOMESERVER/.well-known/matrix/client to fix the homeserver
         URL.
+
+        The result is cached per homeserver for the lifetime of the gateway.
         """
+        server = self.homeserver
+        if cached := _discovered.get(server):
+            self.homeserver = cached
+            return
         response = await self.discovery_info()
         if isinstance(response, nio.DiscoveryInfoResponse):
-            self.homeserver = response.homeserver_url
+            self.homeserver = _discovered[server] = response.homeserver_url
+        elif (r := response.transport_response) is not None and r.status == 404:
+            # no .well-known, no need to ask again
+            _discovered[server] = server
+
+
+class SyncStats:
+    def __init__(self):
+        self.syncs = 0
+        # time.time() of the end of the last successful sync
+        self.last: Optional[float] = None
+        # of the request, including the long-polling, in seconds
+        self.last_duration = 0.0
+        # of handling the response, in seconds
+        self.last_handling = 0.0
+        # exceptions raised by nio's sync loop
+        self.retries = 0
+        self.last_error: Optional[str] = None
 
 
 class Client(AuthenticationClient):
@@ -124,13 +252,39 @@ class Client(AuthenticationClient):
         self.__sync_task: Optional[Task] = None
         self.session = session
         self.reactions = ReactionCache(self)
+        self.__recorder: Optional[SyncRecorder] = None
+        self.sync_stats = SyncStats()
+        self.event_store = EventStore(Path(self.store_path) / "matridge.db")
+        # room ID → users typing in it
+        self.__typing = dict[str, frozenset[str]]()
+        # (room ID, user ID) → last event ID read, and its timestamp if known
+        self.__read = dict[tuple[str, str], tuple[str, Optional[int]]]()
+        # room ID → last event of each kind received in the current sync
+        self.__metadata = dict[str, dict[type, MetadataEvent]]()
+        # IDs of the rooms that have children
+        self.spaces = set[str]()
+        # matrix user ID → direct chat room IDs, from m.direct account data
+        self.direct_rooms: Optional[
+            dict[str, list[str]]
+        ] = self.event_store.get_account_data("m.direct")
+        self.presences = PresenceCoalescer(
+            self.__forward_presence, config.PRESENCE_WINDOW
+        )
+        # members of the rooms that have a MUC on the XMPP side, computed
+        # when a presence needs them
+        self.__participants: Optional[set[str]] = None
+        # room ID → task getting it ready for sending encrypted messages
+        self.__preparing = dict[str, Task]()
+        # IDs of the encrypted rooms we shared a group session with
+        self.__shared = set[str]()
 
     def __add_event_handlers(self):
         self.add_event_callback(self.on_event, nio.Event)  # type:ignore
         self.add_event_callback(self.on_message, nio.RoomMessage)  # type:ignore
-        self.add_event_callback(self.on_avatar, nio.RoomAvatarEvent)  # type:ignore
-        self.add_event_callback(self.on_topic, nio.RoomTopicEvent)  # type:ignore
-        self.add_event_callback(self.on_name, nio.RoomNameEvent)  # type:ignore
+        self.add_event_callback(
+            self.__on_metadata,  # type:ignore
+            (nio.RoomAvatarEvent, nio.RoomTopicEvent, nio.RoomNameEvent),
+        )
         self.add_event_callback(self.on_sticker, nio.StickerEvent)  # type:ignore
         self.add_event_callback(self.on_member, nio.RoomMemberEvent)  # type:ignore
         self.add_event_callback(self.on_redact, nio.RedactionEvent)  # type:ignore
@@ -152,6 +306,8 @@ class Client(AuthenticationClient):
             try:
                 await self.sync_forever(timeout=self.REQUEST_TIMEOUT)
             except Exception as e:
+                self.sync_stats.retries += 1
+                self.sync_stats.last_error = repr(e)
                 duration = time.time() - start
                 if duration < self.CONSIDER_SUCCESSFUL:
                     attempts += 1
@@ -183,7 +339,102 @@ class Client(AuthenticationClient):
         )
         return await muc.get_participant_by_legacy_id(event.sender)
 
+    async def sync(self, *a, **kw):
+        start = time.perf_counter()
+        resp = await super().sync(*a, **kw)
+        if isinstance(resp, nio.SyncResponse):
+            stats = self.sync_stats
+            stats.syncs += 1
+            stats.last = time.time()
+            stats.last_duration = time.perf_counter() - start
+        return resp
+
+    async def receive_response(self, response: nio.Response):
+        if not isinstance(response, nio.SyncResponse):
+            return await super().receive_response(response)
+        if self.__recorder is not None:
+            await self.__recorder.record(response)
+        start = time.perf_counter()
+        # the messages handled by the callbacks are indexed in one go
+        with self.event_store.batch():
+            await super().receive_response(response)
+            # not in a callback, because callbacks are not registered yet
+            # during the initial sync
+            self.__update_account_data(response)
+            self.__update_spaces(response)
+            # nio updates the members without calling on_member() for the
+            # state events preceding the timeline
+            if response.rooms.leave or any(
+                info.state for info in response.rooms.join.values()
+            ):
+                self.forget_participants()
+            await self.__apply_metadata()
+        self.sync_stats.last_handling = time.perf_counter() - start
+
+    async def _handle_to_device(self, response: nio.SyncResponse):
+        # where nio stores the olm sessions and megolm keys it receives; this
+        # does not wait for anything as long as there are no to-device
+        # callbacks, so the crypto store's transaction cannot include writes
+        # made by other tasks
+        if isinstance(self.store, CryptoStore) and not self.to_device_callbacks:
+            batch: ContextManager = self.store.batch()
+        else:
+            batch = nullcontext()
+        with batch:
+            await super()._handle_to_device(response)
+
+    def __update_account_data(self, response: nio.SyncResponse):
+        for event in response.account_data_events:
+            if not isinstance(event, nio.UnknownAccountDataEvent):
+                continue
+            if event.type == "m.direct":
+                self.direct_rooms = event.content
+                self.event_store.set_account_data(event.type, event.content)
+
+    def __update_spaces(self, response: nio.SyncResponse):
+        for room_id, info in response.rooms.join.items():
+            events = itertools.chain(info.state, info.timeline.events)
+            if not any(isinstance(e, nio.RoomSpaceChildEvent) for e in events):
+                continue
+            # nio has already updated the children of the room
+            room = self.rooms.get(room_id)
+            if room is not None and room.children:
+                self.spaces.add(room_id)
+            else:
+                self.spaces.discard(room_id)
+        self.spaces.difference_update(response.rooms.leave)
+
+    async def get_direct_rooms(self) -> dict[str, list[str]]:
+        """
+        :return: The IDs of the direct chat rooms with each matrix user, as
+            the m.direct account data delivered by sync, or fetched if it has
+            not been received yet
+        """
+        if self.direct_rooms is not None:
+            return self.direct_rooms
+        response = await self.list_direct_rooms()
+        if isinstance(response, nio.DirectRoomsErrorResponse):
+            if response.status_code:
+                raise XMPPError(
+                    "internal-server-error",
+                    f"Could not list direct chats: {response.message}",
+                )
+            # there has never been any direct chat
+            return {}
+        self.direct_rooms = response.rooms
+        self.event_store.set_account_data("m.direct", response.rooms)
+        return response.rooms
+
     async def listen(self):
+        if config.SYNC_RECORD_DIR:
+            path = (
+                config.SYNC_RECORD_DIR
+                / f"{self.session.user.bare_jid}-{time.time():.0f}.jsonl"
+            )
+            self.log.info("Recording sync responses to %s", path)
+            self.__recorder = SyncRecorder(
+                path, self.user_id, config.SYNC_RECORD_ANONYMIZE
+            )
         # we need to sync full state or else we don't get the list of all rooms
         resp = await self.sync(full_state=True)
         self.log.debug("Sync")
@@ -192,7 +443,21 @@ class Client(AuthenticationClient):
         self.__add_event_handlers()
         self.__sync_task = create_task(self.__sync_forever())
 
+    def destroy(self):
+        self.event_store.close()
+        super().destroy()
+
     def stop_listen(self):
+        self.get_original_id.cache_clear()
+        self.get_event.cache_clear()
+        self.presences.clear()
+        self.forget_participants()
+        self.__typing.clear()
+        self.__read.clear()
+        for task in self.__preparing.values():
+            task.cancel()
+        self.__preparing.clear()
+        self.__shared.clear()
         if self.__sync_task is None:
             return
         self.__sync_task.cancel()
@@ -210,9 +475,46 @@ class Client(AuthenticationClient):
         if not isinstance(resp, nio.RoomMessagesResponse):
             self.log.warning("Could not fill history.", sync_resp)
             return
+        self.index_messages(room_id, resp.chunk)
         return resp.chunk
 
-    @catch_all
+    def index_messages(self, room_id: str, events: Iterable[nio.Event]):
+        """
+        Remember the messages of a room, so that relating events to them does
+        not require asking the homeserver.
+        """
+        self.event_store.add_messages(
+            room_id,
+            (
+                StoredMessage(
+                    event.event_id,
+                    get_replace(event.source),
+                    get_rel(event.source, "m.thread"),
+                    event.sender,
+                    event.server_timestamp,
+                )
+                for event in events
+                if isinstance(event, nio.RoomMessage)
+            ),
+        )
+
+    def index_sent(self, room_id: str, event_id: str, content: dict):
+        """
+        Remember a message sent by the user, without waiting for it to come
+        back in a sync response.
+        """
+        source = {"content": content}
+        message = StoredMessage(
+            event_id,
+            get_replace(source),
+            get_rel(source, "m.thread"),
+            self.user_id,
+            int(time.time() * 1000),
+        )
+        self.event_store.add_messages(room_id, [message])
+
+    # not wrapped in catch_all, because it would count every event twice in
+    # the metrics
     async def on_event(self, room: nio.MatrixRoom, event: nio.Event):
         if not config.NIO_SILENT:
             self.log.debug("Event %s '%s': %r", type(event), room, event)
@@ -220,6 +522,7 @@ class Client(AuthenticationClient):
     @catch_all
     async def on_message(self, room: nio.MatrixRoom, event: nio.RoomMessage):
         self.log.debug("Message: %s", event)
+        self.index_messages(room.room_id, [event])
 
         participant = await self.get_participant(room, event)
         await participant.send_matrix_message(event)
@@ -227,17 +530,65 @@ class Client(AuthenticationClient):
     async def on_presence(self, presence: nio.PresenceEvent):
         if presence.user_id == self.session.contacts.user_legacy_id:
             return
+        self.presences.add(presence)
+
+    def __is_visible(self, user_id: str) -> bool:
+        """
+        Whether the user is a contact or a participant of a group chat that
+        the XMPP side knows about.
+        """
+        if self.session.contacts.is_known(user_id):
+            return True
+        if self.__participants is None:
+            self.__participants = set()
+            for muc in self.session.bookmarks:
+                if (room := self.rooms.get(muc.legacy_id)) is not None:
+                    self.__participants.update(room.users)
+        return user_id in self.__participants
+
+    def forget_participants(self):
+        """
+        To be called when the members of the rooms that have a MUC may have
+        changed, or when a MUC is created or removed.
+        """
+        self.__participants = None
+
+    async def __forward_presence(self, presence: nio.PresenceEvent) -> bool:
+        if not self.__is_visible(presence.user_id):
+            return False
         try:
             contact = await self.session.contacts.by_legacy_id(presence.user_id)
         except XMPPError as e:
             self.log.debug("Ignoring presence: %s", presence, exc_info=e)
-            return
+            return False
         contact.update_presence(presence)
+        return True
+
+    async def __on_metadata(self, room: nio.MatrixRoom, event: MetadataEvent):
+        # after a downtime, a sync response can contain several changes of the
+        # same room, only the last one of each kind is applied
+        self.__metadata.setdefault(room.room_id, {})[type(event)] = event
+
+    async def __apply_metadata(self):
+        metadata, self.__metadata = self.__metadata, {}
+        for room_id, events in metadata.items():
+            if (room := self.rooms.get(room_id)) is None:
+                continue
+            for event in events.values():
+                if isinstance(event, nio.RoomAvatarEvent):
+                    await self.on_avatar(room, event)
+                elif isinstance(event, nio.RoomTopicEvent):
+                    await self.on_topic(room, event)
+                else:
+                    await self.on_name(room, event)
 
     @catch_all
     async def on_avatar(self, room: nio.MatrixRoom, event: nio.RoomAvatarEvent):
         muc = await self.__get_muc(room)
-        muc.avatar = event.avatar_url
+        if event.avatar_url:
+            muc.avatar = await self.mxc_to_http(event.avatar_url)
+        else:
+            muc.avatar = None
 
     @catch_all
     async def on_topic(self, room: nio.MatrixRoom, event: nio.RoomTopicEvent):
@@ -266,6 +617,11 @@ class Client(AuthenticationClient):
 
     @catch_all
     async def on_member(self, room: nio.MatrixRoom, event: nio.RoomMemberEvent):
+        self.forget_participants()
+        # nio discarded the group session, we were probably sending messages
+        # in this room and will likely send more
+        if room.room_id in self.__shared:
+            self.prepare_encryption(room.room_id)
         muc = await self.__get_muc(room)
         participant = await self.get_participant(room, event)
         if event.membership == "join":
@@ -281,18 +637,55 @@ class Client(AuthenticationClient):
 
     @catch_all
     async def on_typing(self, room: nio.MatrixRoom, event: nio.TypingNoticeEvent):
+        # each event contains everyone typing in the room, not just changes
+        typing = frozenset(event.users)
+        previous = self.__typing.get(room.room_id, frozenset())
+        if typing == previous:
+            return
+        self.__typing[room.room_id] = typing
         muc = await self.__get_muc(room)
-        for user_id in event.users:
+        for user_id in typing - previous:
             participant = await muc.get_participant_by_legacy_id(user_id)
             participant.composing()
+        for user_id in previous - typing:
+            participant = await muc.get_participant_by_legacy_id(user_id)
+            participant.paused()
 
     @catch_all
     async def on_receipt(self, room: nio.MatrixRoom, event: nio.ReceiptEvent):
-        muc = await self.__get_muc(room)
+        # user ID → event ID, only the last one of each user in this batch
+        displayed = dict[str, str]()
         for receipt in event.receipts:
-            if receipt.receipt_type == "m.read":
-                participant = await muc.get_participant_by_legacy_id(receipt.user_id)
-                participant.displayed(receipt.event_id)
+            if receipt.receipt_type == "m.read" and self.__advances(room, receipt):
+                displayed[receipt.user_id] = receipt.event_id
+        if not displayed:
+            return
+        muc = await self.__get_muc(room)
+        for user_id, event_id in displayed.items():
+            participant = await muc.get_participant_by_legacy_id(user_id)
+            participant.displayed(event_id)
+
+    def __advances(self, room: nio.MatrixRoom, receipt: nio.Receipt) -> bool:
+        """
+        Whether a read receipt acknowledges a message that is more recent than
+        the last one acknowledged by this user, as far as we know.
+        """
+        key = room.room_id, receipt.user_id
+        message = self.event_store.get_message(room.room_id, receipt.event_id)
+        timestamp = None if message is None else message.timestamp
+        previous = self.__read.get(key)
+        if previous is not None:
+            previous_id, previous_timestamp = previous
+            if previous_id == receipt.event_id:
+                return False
+            if (
+                timestamp is not None
+                and previous_timestamp is not None
+                and timestamp <= previous_timestamp
+            ):
+                return False
+        self.__read[key] = receipt.event_id, timestamp
+        return True
 
     @catch_all
     async def on_reaction(self, room: nio.MatrixRoom, event: nio.ReactionEvent, **kw):
@@ -322,25 +715,136 @@ class Client(AuthenticationClient):
             redacter.react(msg_id, reactions)
             return
 
-        redacted_event = await self.get_event(room.room_id, event.redacts)
+        if message := self.event_store.get_message(room.room_id, event.redacts):
+            author: Optional[str] = message.sender
+        else:
+            redacted_event = await self.get_event(room.room_id, event.redacts)
+            author = None if redacted_event is None else redacted_event.sender
 
-        if redacted_event and event.sender == redacted_event.sender:
+        if event.sender == author:
             redacter.retract(event.redacts)
         else:
             redacter.moderate(event.redacts, event.reason)
 
-    @alru_cache(maxsize=1000)
+    # these are called by room_send() in encrypted rooms, we override them to
+    # make them appear in traces
+    async def keys_query(self, *a, **kw):
+        with span("keys_query"):
+            return await super().keys_query(*a, **kw)
+
+    async def share_group_session(self, room_id: str, *a, **kw):
+        with span("share_group_session"):
+            response = await super().share_group_session(room_id, *a, **kw)
+        if isinstance(response, nio.ShareGroupSessionResponse):
+            self.__shared.add(room_id)
+        return response
+
+    def encrypt(self, *a, **kw):
+        with span("encrypt"):
+            return super().encrypt(*a, **kw)
+
+    def prepare_encryption(self, room_id: str):
+        """
+        Do in the background what room_send() would do before encrypting a
+        message for this room: fetch its members, query the keys of their
+        devices and share a group session with them, if needed.
+
+        In large rooms, this takes seconds.
+        """
+        room = self.rooms.get(room_id)
+        if self.olm is None or room is None or not room.encrypted:
+            return
+        if room_id in self.__preparing:
+            return
+        if (
+            room.members_synced
+            and not self.should_query_keys
+            and not self.olm.should_share_group_session(room_id)
+        ):
+            return
+        task = create_task(self.__prepare_encryption(room))
+        self.__preparing[room_id] = task
+
+        def done(_):
+            # not a task started after this one was cancelled by stop_listen()
+            if self.__preparing.get(room_id) is task:
+                del self.__preparing[room_id]
+
+        task.add_done_callback(done)
+
+    async def __prepare_encryption(self, room: nio.MatrixRoom):
+        assert self.olm is not None
+        try:
+            if not room.members_synced:
+                await self.joined_members(room.room_id)
+            if self.should_query_keys:
+                await self.keys_query()
+            if (
+                self.olm.should_share_group_session(room.room_id)
+                and room.room_id not in self.sharing_session
+            ):
+                await self.share_group_session(room.room_id)
+        except Exception as e:
+            # room_send() will try again, and fail properly
+            self.log.debug("Could not prepare encryption for %s: %s", room.room_id, e)
+
+    def set_trust(
+        self,
+        state: TrustState,
+        devices: Optional[Iterable[OlmDevice]] = None,
+        user_id: Optional[str] = None,
+        current: Optional[TrustState] = None,
+    ) -> list[OlmDevice]:
+        """
+        Change the trust state of several devices at once.
+
+        :param devices: All known devices if None
+        :param user_id: Only change the devices of this user
+        :param current: Only change the devices that have this state
+        :return: The devices whose state changed
+        """
+        assert isinstance(self.store, CryptoStore)
+        if devices is None:
+            devices = self.device_store
+        changed = self.store.set_trust_states(
+            (
+                d
+                for d in devices
+                if (user_id is None or d.user_id == user_id)
+                and (current is None or d.trust_state == current)
+            ),
+            state,
+        )
+        # like nio does when changing the state of a single device, so that
+        # the devices that are not trusted anymore cannot decrypt the next
+        # messages
+        users = {d.user_id for d in changed}
+        for room in self.rooms.values():
+            if room.encrypted and not users.isdisjoint(room.users):
+                self.invalidate_outbound_session(room.room_id)
+        return changed
+
+    @instance_cache(lambda: config.ORIGINAL_ID_CACHE_SIZE)
     async def get_original_id(self, room_id: str, event_id: str) -> str:
+        if original := self.event_store.get_original_id(room_id, event_id):
+            return original
+        # not seen by this session, e.g. older than the history fetched
         event = await self.get_event(room_id, event_id)
         if event is None:
             return event_id
         # no need to check recursively because replacements must refer to
         # the original event
+        self.index_messages(room_id, [event])
         return get_replace(event.source) or event_id
 
-    @alru_cache(maxsize=100)
+    @instance_cache(lambda: config.EVENT_CACHE_SIZE)
     async def get_event(self, room_id: str, event_id: str) -> Optional[nio.Event]:
         resp = await self.session.matrix.room_get_event(room_id, event_id)
         if isinstance(resp, nio.RoomGetEventError):
             return None
         return resp.event
+
+
+_connectors: dict[str, TCPConnector] = {}
+# homeserver as entered by the user → homeserver URL from .well-known
+_discovered: dict[str, str] = {}
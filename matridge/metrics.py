@@ -0,0 +1,127 @@
+"""
+In-process metrics, written periodically to a file using the prometheus text
+format, eg for the node exporter's "textfile" collector.
+"""
+
+import asyncio
+import logging
+import os
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from pathlib import Path
+
+
+class Histogram:
+    # in seconds
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        # the last one is +Inf
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str = "") -> list[str]:
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for le, n in zip((*self.BUCKETS, "+Inf"), self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+        braces = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{braces} {self.sum}")
+        lines.append(f"{name}_count{braces} {self.count}")
+        return lines
+
+
+class Metrics:
+    """
+    Gateway-wide metrics about the matrix event handlers.
+    """
+
+    def __init__(self):
+        self.calls = Counter[str]()
+        self.errors = Counter[str]()
+        self.latency = defaultdict[str, Histogram](Histogram)
+        # from the event's origin_server_ts to its delivery to XMPP
+        self.delivery = Histogram()
+        # stages of the XMPP → matrix path, see the tracing module
+        self.stages = defaultdict[str, Histogram](Histogram)
+        self.loop_lag = Histogram()
+        # by handler, see the monitor module
+        self.stalls = Counter[str]()
+
+    def observe_handler(self, handler: str, duration: float, error: bool):
+        self.calls[handler] += 1
+        if error:
+            self.errors[handler] += 1
+        self.latency[handler].observe(duration)
+
+    def observe_delivery(self, delay: float):
+        self.delivery.observe(delay)
+
+    def observe_stage(self, stage: str, duration: float):
+        self.stages[stage].observe(duration)
+
+    def observe_loop_lag(self, lag: float):
+        self.loop_lag.observe(lag)
+
+    def observe_stall(self, handler: str):
+        self.stalls[handler] += 1
+
+    def render(self) -> str:
+        lines = [
+            "# TYPE matridge_handler_calls_total counter",
+            *(
+                f'matridge_handler_calls_total{{handler="{h}"}} {n}'
+                for h, n in sorted(self.calls.items())
+            ),
+            "# TYPE matridge_handler_errors_total counter",
+            *(
+                f'matridge_handler_errors_total{{handler="{h}"}} {self.errors[h]}'
+                for h in sorted(self.calls)
+            ),
+            "# TYPE matridge_handler_duration_seconds histogram",
+        ]
+        for h, histogram in sorted(self.latency.items()):
+            lines.extend(
+                histogram.render("matridge_handler_duration_seconds", f'handler="{h}"')
+            )
+        lines.append("# TYPE matridge_delivery_delay_seconds histogram")
+        lines.extend(self.delivery.render("matridge_delivery_delay_seconds"))
+        lines.append("# TYPE matridge_stage_duration_seconds histogram")
+        for stage, histogram in sorted(self.stages.items()):
+            lines.extend(
+                histogram.render("matridge_stage_duration_seconds", f'stage="{stage}"')
+            )
+        lines.append("# TYPE matridge_loop_lag_seconds histogram")
+        lines.extend(self.loop_lag.render("matridge_loop_lag_seconds"))
+        lines.append("# TYPE matridge_loop_stalls_total counter")
+        lines.extend(
+            f'matridge_loop_stalls_total{{handler="{h}"}} {n}'
+            for h, n in sorted(self.stalls.items())
+        )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path):
+        # write then rename, so that readers never see a partial file
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(self.render())
+        os.replace(tmp, path)
+
+    async def write_forever(self, path: Path, interval: float):
+        while True:
+            try:
+                self.write(path)
+            except OSError as e:
+                log.warning("Could not write metrics to %s: %r", path, e)
+            await asyncio.sleep(interval)
+
+
+metrics = Metrics()
+log = logging.getLogger(__name__)
@@ -0,0 +1,202 @@
+"""
+Monitoring of the event loop shared by all sessions, and of the resources used
+by each session.
+
+A watchdog thread notices when the event loop has not run for a while, and
+looks at what the loop thread is doing at that moment to find out which
+session and which handler are blocking it.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from functools import wraps
+from types import FrameType
+from typing import TYPE_CHECKING, Any, Callable, Iterable, NamedTuple, Optional
+
+import nio
+from slidge import BaseSession
+
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from .session import Session
+
+
+class Stall:
+    def __init__(self, location: str, session: Optional[str], handler: Optional[str]):
+        self.timestamp = time.time()
+        self.location = location
+        self.session = session
+        self.handler = handler
+        # how long the event loop has been blocked, in seconds, known once it
+        # runs again
+        self.duration = 0.0
+
+    def __str__(self):
+        return (
+            f"{self.duration:.2f}s in {self.handler or 'unknown handler'} "
+            f"of {self.session or 'no session'} at {self.location}"
+        )
+
+
+class _Entry(NamedTuple):
+    handler: str
+    session: Optional[str]
+
+
+def entry_point(wrapper):
+    """
+    Mark the wrapper function of a decorator, so that stalls happening inside
+    it are attributed to the function it wraps, and to the session its first
+    argument belongs to, if any.
+    """
+
+    @wraps(wrapper)
+    async def registered(*a, **kw):
+        # the watchdog thread must not look at the locals of the frames of the
+        # loop thread, so what it needs to know is registered here
+        frame = sys._getframe()
+        _entries[frame] = _Entry(wrapper.__name__, _session(a[0] if a else None))
+        try:
+            return await wrapper(*a, **kw)
+        finally:
+            del _entries[frame]
+
+    return registered
+
+
+def _session(obj: Any) -> Optional[str]:
+    if isinstance(obj, nio.AsyncClient):
+        obj = getattr(obj, "session", None)
+    if isinstance(obj, BaseSession):
+        return obj.user.bare_jid
+    return None
+
+
+def attribute(frame: Optional[FrameType]) -> Stall:
+    """
+    Find out which session and handler a frame of the loop thread belongs to,
+    by walking up the stack: while a task runs, the frames of the coroutines
+    it awaits are linked together.
+
+    The session is the innermost one of the :func:`entry_point` in the stack,
+    the handler is the function wrapped by the outermost one.
+
+    This runs in another thread than the frame's, so it only reads what does
+    not change while the frame runs.
+    """
+    location = "unknown location"
+    if frame is not None:
+        code = frame.f_code
+        location = f"{code.co_filename}:{frame.f_lineno} ({code.co_name})"
+    session = None
+    handler = None
+    while frame is not None:
+        if (entry := _entries.get(frame)) is not None:
+            handler = entry.handler
+            session = session or entry.session
+        frame = frame.f_back
+    return Stall(location, session, handler)
+
+
+class LoopMonitor:
+    """
+    Measures the event loop lag, and logs what blocks it when it exceeds the
+    threshold.
+    """
+
+    def __init__(self, threshold: float, interval=0.1):
+        """
+        :param threshold: Report stalls longer than this, in seconds
+        :param interval: How often the lag is measured, in seconds
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque[Stall](maxlen=100)
+        self.max_lag = 0.0
+        self.__beat = time.monotonic()
+        self.__stall: Optional[Stall] = None
+        self.__loop_thread = 0
+        self.__stopped = threading.Event()
+
+    async def run(self):
+        self.__loop_thread = threading.get_ident()
+        self.__stopped.clear()
+        threading.Thread(target=self.__watch, name="loop monitor", daemon=True).start()
+        try:
+            while True:
+                self.__beat = start = time.monotonic()
+                await asyncio.sleep(self.interval)
+                self.__measure(time.monotonic() - start - self.interval)
+        finally:
+            self.__stopped.set()
+
+    def __measure(self, lag: float):
+        metrics.observe_loop_lag(lag)
+        self.max_lag = max(self.max_lag, lag)
+        stall, self.__stall = self.__stall, None
+        if stall is not None:
+            stall.duration = lag
+            self.stalls.append(stall)
+            metrics.observe_stall(stall.handler or "unknown")
+            log.warning("The event loop was blocked for %s", stall)
+
+    def __watch(self):
+        reported = None
+        while not self.__stopped.wait(self.interval):
+            beat = self.__beat
+            if beat == reported:
+                continue
+            if time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self.__loop_thread)
+            self.__stall = attribute(frame)
+
+
+def session_stats(session: "Session") -> dict[str, int]:
+    """
+    Counts of what a session keeps in memory.
+    """
+    matrix = session.matrix
+    tasks = 0
+    for task in asyncio.all_tasks():
+        frame = getattr(task.get_coro(), "cr_frame", None)
+        if frame is None:
+            continue
+        obj = frame.f_locals.get("self")
+        if obj is session or obj is matrix:
+            tasks += 1
+    return {
+        "rooms": len(matrix.rooms),
+        "mucs": len(list(session.bookmarks)),
+        "contacts": len(list(session.contacts)),
+        "cached_events": matrix.get_event.cache_info().currsize,
+        "cached_original_ids": matrix.get_original_id.cache_info().currsize,
+        **{f"reaction_{k}": v for k, v in matrix.reactions.stats().items()},
+        **{f"presence_{k}": v for k, v in matrix.presences.stats().items()},
+        **{f"stored_{k}": v for k, v in matrix.event_store.stats().items()},
+        "events_to_ignore": len(session.events_to_ignore),
+        "tasks": tasks,
+    }
+
+
+async def log_session_stats_forever(
+    sessions: Callable[[], Iterable["Session"]], interval: float
+):
+    while True:
+        await asyncio.sleep(interval)
+        for session in sessions():
+            if session.logged:
+                log.info(
+                    "Resources of %s: %s", session.user.bare_jid, session_stats(session)
+                )
+
+
+# frames of the running entry points → what they are running
+_entries = dict[FrameType, _Entry]()
+log = logging.getLogger(__name__)
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+import nio
+
+
+class PresenceState(NamedTuple):
+    """
+    What is visible on the XMPP side of a matrix presence, that is, everything
+    but last_active_ago, which changes in almost every presence event.
+    """
+
+    presence: str
+    currently_active: bool
+    status: Optional[str]
+
+    @staticmethod
+    def from_event(event: nio.PresenceEvent) -> "PresenceState":
+        return PresenceState(
+            event.presence, bool(event.currently_active), event.status_msg
+        )
+
+
+class PresenceCoalescer:
+    """
+    Forwards matrix presences to XMPP, keeping only the last presence of each
+    user received within a time window, and dropping those that do not change
+    anything since the last one that was forwarded.
+
+    Large accounts receive thousands of presence events per sync, most of them
+    only updating last_active_ago.
+    """
+
+    def __init__(
+        self, forward: Callable[[nio.PresenceEvent], Awaitable[bool]], window: float
+    ):
+        """
+        :param forward: Returns False if the presence was not forwarded, e.g.
+            because the user is not a contact, so that it is not remembered
+        :param window: In seconds
+        """
+        self.forward = forward
+        self.window = window
+        self.dropped = 0
+        self.__forwarded = dict[str, PresenceState]()
+        self.__pending = dict[str, nio.PresenceEvent]()
+        self.__task: Optional[asyncio.Task] = None
+        # the user whose presence is being forwarded
+        self.__current: Optional[str] = None
+
+    def add(self, event: nio.PresenceEvent):
+        user_id = event.user_id
+        state = PresenceState.from_event(event)
+        if (
+            user_id not in self.__pending
+            and user_id != self.__current
+            and self.__forwarded.get(user_id) == state
+        ):
+            self.dropped += 1
+            return
+        self.__pending[user_id] = event
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__flush())
+
+    async def __flush(self):
+        try:
+            while self.__pending:
+                await asyncio.sleep(self.window)
+                # presences received meanwhile replace those of users not
+                # forwarded yet, and are forwarded in the next round for the
+                # others
+                for user_id in list(self.__pending):
+                    if (event := self.__pending.pop(user_id, None)) is None:
+                        continue
+                    self.__current = user_id
+                    await self.__forward(user_id, event)
+                self.__current = None
+        finally:
+            if self.__task is asyncio.current_task():
+                self.__task = None
+                self.__current = None
+
+    async def __forward(self, user_id: str, event: nio.PresenceEvent):
+        state = PresenceState.from_event(event)
+        if self.__forwarded.get(user_id) == state:
+            self.dropped += 1
+            return
+        try:
+            forwarded = await self.forward(event)
+        except Exception as e:
+            log.exception("Could not forward presence %s", event, exc_info=e)
+            return
+        if forwarded:
+            self.__forwarded[user_id] = state
+        else:
+            self.dropped += 1
+
+    def clear(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        self.__current = None
+        self.__pending.clear()
+        self.__forwarded.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "users": len(self.__forwarded),
+            "pending": len(self.__pending),
+            "dropped": self.dropped,
+        }
+
+
+log = logging.getLogger(__name__)
@@ -0,0 +1,125 @@
+"""
+On-demand profiling of a running gateway with cProfile.
+
+Results are written in the pstats format, that can be read with
+``python -m pstats`` or tools such as snakeviz.
+"""
+
+import asyncio
+import cProfile
+import logging
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Any, Awaitable, Generator, Optional
+
+from slidge.core import config as global_config
+
+
+class Capture:
+    def __init__(self, path: Path, user: Optional[str]):
+        """
+        :param path: Where to write the results
+        :param user: Only profile the handlers of the session of this user
+            (bare JID), or everything running in the event loop if None
+        """
+        self.path = path
+        self.user = user
+        self.profiler = cProfile.Profile()
+        # to avoid enabling the profiler twice when handlers are nested
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+
+    def wants(self, obj: Any) -> bool:
+        if self.user is None or self.running:
+            return False
+        session = getattr(obj, "session", obj)
+        user = getattr(session, "user", None)
+        return user is not None and user.bare_jid == self.user
+
+
+class _Profiled:
+    """
+    Drives a coroutine, profiling only while it runs, and not while it waits
+    for something, when other tasks run.
+    """
+
+    def __init__(self, coro: Awaitable, capture: Capture):
+        self.coro = coro
+        self.capture = capture
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        it = self.coro.__await__()
+        send: Any = None
+        throw: Optional[BaseException] = None
+        while True:
+            self.capture.running = True
+            self.capture.profiler.enable()
+            try:
+                if throw is None:
+                    yielded = it.send(send)
+                else:
+                    yielded = it.throw(throw)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.capture.profiler.disable()
+                self.capture.running = False
+            try:
+                send, throw = (yield yielded), None
+            except BaseException as e:
+                send, throw = None, e
+
+
+def profiled(func):
+    """
+    Make the calls to this coroutine function profiled during captures scoped
+    to the session it belongs to.
+
+    Its first argument must be a session or have a ``session`` attribute.
+    """
+
+    @wraps(func)
+    async def wrapped(*a, **kw):
+        coro = func(*a, **kw)
+        if _capture is not None and a and _capture.wants(a[0]):
+            return await _Profiled(coro, _capture)
+        return await coro
+
+    return wrapped
+
+
+def start(duration: float, user: Optional[str] = None) -> Path:
+    """
+    Start a capture in the background.
+
+    :return: The path the results will be written to
+    """
+    global _capture
+    if _capture is not None:
+        raise RuntimeError("A capture is already running")
+    directory = global_config.HOME_DIR / "profiles"
+    directory.mkdir(exist_ok=True)
+    name = datetime.now().strftime("%Y%m%d-%H%M%S")
+    if user:
+        name += f"-{user}"
+    capture = _capture = Capture(directory / f"{name}.prof", user)
+    if user is None:
+        capture.profiler.enable()
+    capture.task = asyncio.create_task(_stop_later(capture, duration))
+    return capture.path
+
+
+async def _stop_later(capture: Capture, duration: float):
+    global _capture
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        capture.profiler.disable()
+        _capture = None
+        capture.profiler.dump_stats(capture.path)
+        log.info("Profile written to %s", capture.path)
+
+
+_capture: Optional[Capture] = None
+log = logging.getLogger(__name__)
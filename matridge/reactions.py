@@ -114,6 +114,33 @@ class ReactionCache:
         else:
             return set(r.emoji for r in self._reaction_cache[target])
 
+    def stats(self) -> dict[str, int]:
+        return {
+            "targets": len(self._reaction_cache),
+            "events": len(self._event_cache),
+        }
+
+    def clear(self):
+        self._reaction_cache.clear()
+        self._event_cache.clear()
+
+    def rename(self, old_event_id: str, new_event_id: str) -> None:
+        """
+        Replace the event ID of a reaction, e.g. a placeholder by the ID the
+        homeserver gave to the reaction once it was sent.
+        """
+        target = self._event_cache.pop(old_event_id, None)
+        if target is None:
+            return
+        self._event_cache[new_event_id] = target
+        cache = self._reaction_cache[target]
+        cache[:] = [
+            Reaction(event=new_event_id, emoji=r.emoji)
+            if r.event == old_event_id
+            else r
+            for r in cache
+        ]
+
     def remove(self, event_id: str) -> Optional[ReactionTarget]:
         self.log.debug("Needle: %s; Haystack: %s", event_id, self._event_cache)
         target = self._event_cache.pop(event_id, None)
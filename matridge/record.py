@@ -0,0 +1,110 @@
+"""
+Recording of raw sync responses, to replay captured traffic offline with
+``python -m matridge.replay``.
+
+A recording is a JSON lines file. The first line is a header with the matrix
+ID of the user, every other line is a sync response, in the order they were
+received. The first response is the initial sync, done before the event
+handlers are registered (see :meth:`matridge.matrix.Client.listen`).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+import nio
+
+# their values are replaced by placeholders of the same length
+TEXT_KEYS = frozenset(
+    [
+        "body",
+        "formatted_body",
+        "displayname",
+        "name",
+        "topic",
+        "filename",
+        # presence status and membership/redaction reasons
+        "status_msg",
+        "reason",
+    ]
+)
+ANONYMOUS_SERVER = "anon.invalid"
+
+
+class Anonymizer:
+    """
+    Replaces matrix identifiers, media URLs and texts in sync responses.
+
+    Identifiers are replaced by (salted) hashes, so that references between
+    events are preserved within a recording.
+    """
+
+    def __init__(self, salt: bytes):
+        self.salt = salt
+
+    def __hash(self, s: str) -> str:
+        return hashlib.blake2b(s.encode(), key=self.salt, digest_size=9).hexdigest()
+
+    def identifier(self, s: str) -> str:
+        if s.startswith("mxc://"):
+            return f"mxc://{ANONYMOUS_SERVER}/{self.__hash(s)}"
+        if s[:1] not in ("@", "!", "#", "$"):
+            return s
+        if ":" in s:
+            return f"{s[0]}{self.__hash(s)}:{ANONYMOUS_SERVER}"
+        return s[0] + self.__hash(s)
+
+    def __call__(self, obj: Any) -> Any:
+        if isinstance(obj, dict):
+            return {
+                self.identifier(k): "x" * len(v)
+                if k in TEXT_KEYS and isinstance(v, str)
+                else self(v)
+                for k, v in obj.items()
+            }
+        if isinstance(obj, list):
+            return [self(v) for v in obj]
+        if isinstance(obj, str):
+            return self.identifier(obj)
+        return obj
+
+
+class SyncRecorder:
+    def __init__(self, path: Path, user_id: str, anonymize: bool):
+        self.path = path
+        self.anonymizer = Anonymizer(os.urandom(16)) if anonymize else None
+        self.__write({"user_id": self.__anonymize(user_id), "time": time.time()})
+
+    def __anonymize(self, obj: Any) -> Any:
+        return obj if self.anonymizer is None else self.anonymizer(obj)
+
+    def __write(self, obj: dict):
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(obj) + "\n")
+        except OSError as e:
+            log.warning("Could not record sync response to %s: %r", self.path, e)
+
+    async def record(self, response: nio.SyncResponse):
+        if response.transport_response is None:
+            return
+        # the body has already been read and parsed by nio, this just
+        # parses it again
+        data = await response.transport_response.json()
+        self.__write(self.__anonymize(data))
+
+
+def load(path: Path) -> tuple[str, list[dict]]:
+    """
+    :return: The matrix ID of the user and the raw sync responses
+    """
+    with open(path) as f:
+        header = json.loads(f.readline())
+        return header["user_id"], [json.loads(line) for line in f]
+
+
+log = logging.getLogger(__name__)
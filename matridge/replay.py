@@ -0,0 +1,153 @@
+"""
+Replay sync responses recorded with ``SYNC_RECORD_DIR`` through the matrix
+event handlers of a session, as fast as possible, to benchmark the handlers
+against real traffic offline.
+
+Usage::
+
+    python -m matridge.replay RECORDING.jsonl --repeat 10
+
+The session runs against :class:`matridge.fake_homeserver.FakeHomeserver`, so
+the requests the handlers make (fetching events, profiles…) can succeed, but
+their responses are not those of the original homeserver. Only the profiles of
+the users of the recording user's homeserver exist there, which is all of them
+in anonymized recordings.
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import nio
+from slidge import user_store
+
+from .fake_homeserver import FakeHomeserver
+from .loadtest import NullTransport, join, log_in, setup_gateway
+from .metrics import metrics
+from .record import load
+
+
+class ReplayResult(NamedTuple):
+    responses: int
+    events: int
+    # in seconds
+    duration: float
+
+
+def senders(response: dict) -> set[str]:
+    return {
+        event["sender"]
+        for room in response.get("rooms", {}).get("join", {}).values()
+        for key in ("timeline", "state")
+        for event in room.get(key, {}).get("events", [])
+        if "sender" in event
+    }
+
+
+def count_events(response: dict) -> int:
+    n = len(response.get("presence", {}).get("events", []))
+    for room in response.get("rooms", {}).get("join", {}).values():
+        n += len(room.get("timeline", {}).get("events", []))
+        n += len(room.get("ephemeral", {}).get("events", []))
+    return n
+
+
+async def apply(client: nio.AsyncClient, response: dict, callbacks=True):
+    """
+    Make the client handle a raw sync response, like it does when it receives
+    one from the homeserver.
+    """
+    if callbacks:
+        await client.receive_response(nio.SyncResponse.from_dict(response))
+        return
+    saved = client.event_callbacks, client.ephemeral_callbacks
+    client.event_callbacks, client.ephemeral_callbacks = [], []
+    try:
+        await client.receive_response(nio.SyncResponse.from_dict(response))
+    finally:
+        client.event_callbacks, client.ephemeral_callbacks = saved
+
+
+async def replay(
+    client: nio.AsyncClient, responses: list[dict], repeat=1
+) -> ReplayResult:
+    events = sum(map(count_events, responses)) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for response in responses:
+            await apply(client, response)
+    return ReplayResult(len(responses) * repeat, events, time.perf_counter() - start)
+
+
+async def main(path: Path, repeat: int):
+    user_id, responses = load(path)
+    localpart, server_name = user_id[1:].split(":", 1)
+    if not responses:
+        print("Empty recording")
+        return
+
+    transport = NullTransport()
+    with tempfile.TemporaryDirectory(prefix="matridge-replay-") as home:
+        xmpp = setup_gateway(Path(home), transport)
+        async with FakeHomeserver(server_name) as homeserver:
+            # so that fetching their profiles works
+            for sender in set[str]().union(*map(senders, responses)):
+                if sender.endswith(":" + server_name):
+                    homeserver.register(sender[1:].split(":", 1)[0])
+            homeserver.register(localpart)
+            session = await log_in(xmpp, homeserver, localpart)
+            client = session.matrix
+            try:
+                client.stop_listen()
+                # like Client.listen(), the initial sync does not trigger the
+                # handlers
+                await apply(client, responses[0], callbacks=False)
+                mucs = [await session.bookmarks.by_legacy_id(r) for r in client.rooms]
+                for muc in mucs:
+                    join(xmpp, session, muc)
+                while not all(muc.user_resources for muc in mucs):
+                    await asyncio.sleep(0.01)
+
+                result = await replay(client, responses[1:], repeat)
+                print(
+                    f"{result.responses} responses, {result.events} events "
+                    f"in {result.duration:.2f}s: {result.events / result.duration:.0f} "
+                    "events/s"
+                )
+                start = time.perf_counter()
+                await xmpp.waiting_queue.join()
+                print(
+                    f"{transport.stanzas} stanzas sent, the last ones "
+                    f"{time.perf_counter() - start:.2f}s after the end of the replay"
+                )
+                for handler, histogram in sorted(metrics.latency.items()):
+                    print(
+                        f"{handler}: {histogram.count} calls, "
+                        f"{metrics.errors[handler]} errors, "
+                        f"mean {histogram.sum / histogram.count * 1000:.2f}ms"
+                    )
+            finally:
+                await client.close()
+                client.event_store.close()
+                if xmpp._run_out_filters is not None:
+                    xmpp._run_out_filters.cancel()
+                # its data is about to be removed with the directory
+                user_store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay recorded sync responses through matridge's handlers."
+    )
+    parser.add_argument("recording", type=Path)
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Replay the recording this many times"
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    asyncio.run(main(args.recording, args.repeat))
@@ -1,5 +1,7 @@
+import asyncio
 import io
-from typing import Any, Optional, Union
+import uuid
+from typing import TYPE_CHECKING, Any, Awaitable, Optional, Union
 
 import aiohttp
 import nio
@@ -16,8 +18,12 @@ from slixmpp.exceptions import XMPPError
 from .contact import Contact, Roster
 from .group import MUC, Bookmarks, Participant
 from .matrix import Client
+from .tracing import span, traced
 from .util import get_content
 
+if TYPE_CHECKING:
+    from .gateway import Gateway
+
 Sender = Union[Contact, Participant]
 Recipient = Union[MUC, Contact]
 
@@ -37,21 +43,35 @@ class Session(BaseSession[str, Recipient]):
     bookmarks: Bookmarks
     contacts: Roster
     matrix: Client
+    xmpp: "Gateway"
 
     MESSAGE_IDS_ARE_THREAD_IDS = True
+    # maximum number of requests sent at the same time to change reactions
+    REACTION_CONCURRENCY = 4
 
     def __init__(self, *a):
         super().__init__(*a)
+        self.xmpp.add_session(self)
         self.events_to_ignore = set[str]()
+        # (room ID, message ID, our user ID) → lock serializing the changes of
+        # our reactions to this message, and the number of calls using it
+        self.__reacting = dict[tuple[str, str, str], tuple[asyncio.Lock, int]]()
 
     async def login(self):
         f = self.user.registration_form
         self.matrix = Client(f["homeserver"], f["username"], self)  # type:ignore
-        await self.matrix.login_token()
-        await self.matrix.listen()
+        scheduler = self.xmpp.login_scheduler
+        self.log.debug("Waiting for a login slot, %s in line", scheduler.waiting)
+        async with scheduler.slot(self.__is_online):
+            await self.matrix.login_token()
+            await self.matrix.listen()
         self.contacts.user_legacy_id = self.matrix.user_id
         return f"Logged in as {self.matrix.user}"
 
+    def __is_online(self) -> bool:
+        roster = self.xmpp.roster[self.xmpp.boundjid.bare]
+        return bool(roster[self.user.bare_jid].resources)
+
     async def logout(self):
         self.matrix.stop_listen()
 
@@ -64,9 +84,9 @@ class Session(BaseSession[str, Recipient]):
     ):
         relates_to = dict[str, Any]()
         if reply_to_msg_id:
-            relates_to["m.in_reply_to"] = {
-                "event_id": await self.matrix.get_original_id(room_id, reply_to_msg_id)
-            }
+            with span("get_original_id"):
+                event_id = await self.matrix.get_original_id(room_id, reply_to_msg_id)
+            relates_to["m.in_reply_to"] = {"event_id": event_id}
         if thread:
             relates_to["rel_type"] = "m.thread"
             relates_to["event_id"] = thread
@@ -85,15 +105,22 @@ class Session(BaseSession[str, Recipient]):
     async def __room_send(
         self, chat: MUC, content: dict, message_type="m.room.message"
     ):
-        await self.matrix.room_typing(chat.legacy_id, False)
-        response = await self.matrix.room_send(
-            chat.legacy_id,
-            message_type=message_type,
-            content=content,
-        )
-        return await self.__handle_response(response)
+        if message_type == "m.room.message":
+            with span("room_typing"):
+                await self.matrix.room_typing(chat.legacy_id, False)
+        with span("room_send"):
+            response = await self.matrix.room_send(
+                chat.legacy_id,
+                message_type=message_type,
+                content=content,
+            )
+        event_id = await self.__handle_response(response)
+        if message_type == "m.room.message":
+            self.matrix.index_sent(chat.legacy_id, event_id, content)
+        return event_id
 
     @no_dm
+    @traced
     async def send_text(
         self,
         chat: MUC,
@@ -104,11 +131,13 @@ class Session(BaseSession[str, Recipient]):
         reply_to: Optional[Sender] = None,
         thread: Optional[str] = None,
     ) -> Optional[LegacyMessageType]:
-        content = get_content(text)
+        with span("get_content"):
+            content = get_content(text)
         await self.__relates_to(chat.legacy_id, content, reply_to_msg_id, thread)
         return await self.__room_send(chat, content)
 
     @no_dm
+    @traced
     async def send_file(
         self,
         chat: MUC,
@@ -122,9 +151,10 @@ class Session(BaseSession[str, Recipient]):
     ) -> Optional[LegacyMessageType]:
         filename = url.split("/")[-1]
         content_type = http_response.content_type
-        resp, _ = await self.matrix.upload(
-            io.BytesIO(await http_response.read()), content_type, filename
-        )
+        with span("read_file"):
+            data = await http_response.read()
+        with span("upload"):
+            resp, _ = await self.matrix.upload(io.BytesIO(data), content_type, filename)
         self.log.debug("Upload response: %s %r", type(resp), resp)
         if not isinstance(resp, nio.UploadResponse):
             raise XMPPError("internal-server-error", str(resp))
@@ -146,6 +176,8 @@ class Session(BaseSession[str, Recipient]):
 
     @no_dm
     async def composing(self, c: MUC, thread: Optional[LegacyThreadType] = None):
+        # so that sending the message only has to encrypt it
+        self.matrix.prepare_encryption(c.legacy_id)
         await self.matrix.room_typing(c.legacy_id)
 
     @no_dm
@@ -163,6 +195,7 @@ class Session(BaseSession[str, Recipient]):
         self.log.debug("Displayed response: %s", resp)
 
     @no_dm
+    @traced
     async def correct(
         self,
         c: MUC,
@@ -170,10 +203,12 @@ class Session(BaseSession[str, Recipient]):
         legacy_msg_id: str,
         thread: Optional[str] = None,
     ) -> Optional[str]:
+        with span("get_content"):
+            new_content = get_content(text)
         content = {
             "msgtype": "m.text",
             "body": "* " + text,
-            "m.new_content": get_content(text),
+            "m.new_content": new_content,
             "m.relates_to": {"rel_type": "m.replace", "event_id": legacy_msg_id},
         }
         await self.__relates_to(c.legacy_id, content, None, thread)
@@ -202,20 +237,8 @@ class Session(BaseSession[str, Recipient]):
         raise XMPPError("bad-request", "This does not look like a valid matrix id")
 
     async def find_direct_room(self, mxid: str) -> Optional[str]:
-        response = await self.matrix.list_direct_rooms()
-        if isinstance(response, nio.responses.DirectRoomsErrorResponse):
-            self.log.warning(response)
-            if response.status_code:
-                raise XMPPError(
-                    "bad-request", f"Something went wrong: {response.message}"
-                )
-
-            return await self.open_direct_message(mxid)
-
-        self.log.warning(response.rooms[mxid])
-        if response.rooms[mxid]:
-            return response.rooms[mxid][0]
-
+        if rooms := (await self.matrix.get_direct_rooms()).get(mxid):
+            return rooms[0]
         return await self.open_direct_message(mxid)
 
     async def open_direct_message(self, mxid: str) -> Optional[str]:
@@ -235,6 +258,7 @@ class Session(BaseSession[str, Recipient]):
         raise XMPPError("bad-request", f"Something went wrong: {response.message}")
 
     @no_dm
+    @traced
     async def react(
         self,
         c: MUC,
@@ -242,31 +266,78 @@ class Session(BaseSession[str, Recipient]):
         emojis: list[str],
         thread: Optional[LegacyThreadType] = None,
     ):
-        new_emojis = set(emojis)
-        old_emojis = await self.matrix.reactions.get(
-            c.legacy_id, legacy_msg_id, self.matrix.user_id, with_event_ids=True
-        )
+        target = c.legacy_id, legacy_msg_id, self.matrix.user_id
+        # one change after the other, or else the placeholders of the reactions
+        # being sent by a change would be taken for reactions to redact by the
+        # next one
+        lock, users = self.__reacting.get(target, (asyncio.Lock(), 0))
+        self.__reacting[target] = lock, users + 1
+        try:
+            async with lock:
+                await self.__react(c, target, set(emojis))
+        finally:
+            lock, users = self.__reacting.pop(target)
+            if users > 1:
+                self.__reacting[target] = lock, users - 1
+
+    async def __react(self, c: MUC, target: tuple[str, str, str], new_emojis: set[str]):
+        reactions = self.matrix.reactions
+        with span("get_reactions"):
+            old_emojis = await reactions.get(*target, with_event_ids=True)
+        # the cache is updated before the requests are sent, and rolled back
+        # for those that fail
+        requests = list[Awaitable[None]]()
         for old_emoji, event in old_emojis.items():
             if old_emoji in new_emojis:
                 new_emojis.remove(old_emoji)
             else:
-                await self.retract(c, event)
-                self.matrix.reactions.remove(event)
+                reactions.remove(event)
+                requests.append(self.__remove_reaction(c, target, old_emoji, event))
         for emoji in new_emojis:
-            content = {
-                "m.relates_to": {
-                    "rel_type": "m.annotation",
-                    "event_id": legacy_msg_id,
-                    "key": emoji,
-                },
-            }
-
-            i = await self.__room_send(c, content, "m.reaction")
-            await self.matrix.reactions.add(
-                c.legacy_id, legacy_msg_id, self.matrix.user_id, emoji, i
-            )
+            placeholder = f"pending-{uuid.uuid4()}"
+            await reactions.add(*target, emoji, placeholder)
+            requests.append(self.__add_reaction(c, target, emoji, placeholder))
+
+        semaphore = asyncio.Semaphore(self.REACTION_CONCURRENCY)
+
+        async def bounded(request: Awaitable[None]):
+            async with semaphore:
+                await request
+
+        for result in await asyncio.gather(
+            *map(bounded, requests), return_exceptions=True
+        ):
+            if isinstance(result, BaseException):
+                raise result
+
+    async def __remove_reaction(
+        self, c: MUC, target: tuple[str, str, str], emoji: str, event: str
+    ):
+        try:
+            await self.retract(c, event)
+        except BaseException:
+            await self.matrix.reactions.add(*target, emoji, event)
+            raise
+
+    async def __add_reaction(
+        self, c: MUC, target: tuple[str, str, str], emoji: str, placeholder: str
+    ):
+        content = {
+            "m.relates_to": {
+                "rel_type": "m.annotation",
+                "event_id": target[1],
+                "key": emoji,
+            },
+        }
+        try:
+            event = await self.__room_send(c, content, "m.reaction")
+        except BaseException:
+            self.matrix.reactions.remove(placeholder)
+            raise
+        self.matrix.reactions.rename(placeholder, event)
 
     @no_dm
+    @traced
     async def retract(
         self,
         c: RecipientType,
@@ -274,7 +345,8 @@ class Session(BaseSession[str, Recipient]):
         thread: Optional[str] = None,
     ):
         # TODO
-        resp = await self.matrix.room_redact(c.legacy_id, legacy_msg_id)
+        with span("room_redact"):
+            resp = await self.matrix.room_redact(c.legacy_id, legacy_msg_id)
         self.log.debug("Redact response: %s", resp)
         if isinstance(resp, nio.RoomRedactError):
             raise XMPPError("internal-server-error", str(resp))
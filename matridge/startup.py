@@ -0,0 +1,61 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Callable
+
+
+class LoginScheduler:
+    """
+    Limits the number of logins running at the same time, so that restarting
+    the gateway does not hammer the homeservers with every user's initial sync.
+
+    When a slot is freed, users that have an XMPP client online go first,
+    then users are logged in the order they asked for it.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._running = 0
+        self._waiting = list[tuple[Callable[[], bool], asyncio.Future]]()
+
+    @asynccontextmanager
+    async def slot(self, is_online: Callable[[], bool]):
+        """
+        :param is_online: evaluated when a slot is freed, rather than on entry,
+            since XMPP clients presences may arrive while users are waiting
+        """
+        await self._acquire(is_online)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, is_online: Callable[[], bool]):
+        if self.limit <= 0 or (self._running < self.limit and not self._waiting):
+            self._running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((is_online, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # we were given a slot but won't use it
+                self._release()
+            raise
+
+    def _release(self):
+        self._running -= 1
+        while self._waiting and self._running < self.limit:
+            i = next(
+                (i for i, (is_online, _) in enumerate(self._waiting) if is_online()),
+                0,
+            )
+            _, future = self._waiting.pop(i)
+            if future.cancelled():
+                continue
+            self._running += 1
+            future.set_result(None)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
@@ -0,0 +1,193 @@
+"""
+Persistent data of a session that nio does not keep, in an SQLite database in
+its state directory.
+"""
+
+import json
+import logging
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+# the database's user_version is the number of these that were applied; the
+# first version of this module created the replacement table without setting
+# it, hence the IF (NOT) EXISTS
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS replacement (
+        room_id TEXT NOT NULL,
+        event_id TEXT NOT NULL,
+        original_id TEXT NOT NULL,
+        PRIMARY KEY (room_id, event_id)
+    ) WITHOUT ROWID;
+    """,
+    """
+    DROP TABLE IF EXISTS replacement;
+    CREATE TABLE message (
+        room_id TEXT NOT NULL,
+        event_id TEXT NOT NULL,
+        original_id TEXT,
+        thread TEXT,
+        sender TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        PRIMARY KEY (room_id, event_id)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE account_data (
+        type TEXT PRIMARY KEY,
+        content TEXT NOT NULL
+    );
+    """,
+]
+
+
+class StoredMessage(NamedTuple):
+    event_id: str
+    # the event this one replaces, if it is a correction
+    original_id: Optional[str]
+    # the root event of the thread it belongs to
+    thread: Optional[str]
+    sender: str
+    # in milliseconds since the epoch, as in matrix events
+    timestamp: int
+
+
+class EventStore:
+    """
+    Messages are written as they are received, sent or fetched. To avoid
+    waiting for the disk for each of them in the event loop, the database is
+    in WAL mode, where commits only append to a log without waiting for it to
+    reach the disk, and the writes made while handling a sync response are
+    grouped with :meth:`batch`.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.__db = sqlite3.connect(path)
+        self.__batches = 0
+        # written when the last batch ends
+        self.__messages = dict[tuple[str, str], StoredMessage]()
+        self.__account_data = dict[str, dict]()
+        try:
+            self.__db.execute("PRAGMA journal_mode = WAL")
+            # can only lose the last transactions on power loss
+            self.__db.execute("PRAGMA synchronous = NORMAL")
+            self.__migrate()
+        except Exception:
+            self.__db.close()
+            raise
+
+    def __migrate(self):
+        (version,) = self.__db.execute("PRAGMA user_version").fetchone()
+        for i, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            log.debug("Migrating %s to version %s", self.path, i)
+            try:
+                self.__db.executescript(
+                    f"BEGIN; {script} PRAGMA user_version = {i}; COMMIT;"
+                )
+            except sqlite3.Error:
+                if self.__db.in_transaction:
+                    self.__db.rollback()
+                raise
+
+    def close(self):
+        self.__db.close()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Keep the writes done in this context in memory, and write them in a
+        single transaction when it ends, even if it ends with an exception:
+        they describe events that have been received or sent anyway.
+
+        Batches may overlap, e.g. when a message is sent while a sync response
+        is handled: the writes are done when the last one ends. No transaction
+        is open while the context waits for something, so writes from other
+        tasks cannot be rolled back with it.
+        """
+        self.__batches += 1
+        try:
+            yield
+        finally:
+            self.__batches -= 1
+            if self.__batches == 0:
+                self.__flush()
+
+    def __flush(self):
+        if not self.__messages and not self.__account_data:
+            return
+        with self.__db:
+            self.__db.executemany(
+                "INSERT OR IGNORE INTO message VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (room_id, *message)
+                    for (room_id, _), message in self.__messages.items()
+                ),
+            )
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO account_data VALUES (?, ?)",
+                (
+                    (type_, json.dumps(content))
+                    for type_, content in self.__account_data.items()
+                ),
+            )
+        self.__messages.clear()
+        self.__account_data.clear()
+
+    def add_messages(self, room_id: str, messages: Iterable[StoredMessage]):
+        if self.__batches:
+            for message in messages:
+                self.__messages.setdefault((room_id, message.event_id), message)
+            return
+        with self.__db:
+            self.__db.executemany(
+                "INSERT OR IGNORE INTO message VALUES (?, ?, ?, ?, ?, ?)",
+                ((room_id, *message) for message in messages),
+            )
+
+    def get_message(self, room_id: str, event_id: str) -> Optional[StoredMessage]:
+        row = self.__db.execute(
+            "SELECT event_id, original_id, thread, sender, timestamp FROM message "
+            "WHERE room_id = ? AND event_id = ?",
+            (room_id, event_id),
+        ).fetchone()
+        if row is None:
+            return self.__messages.get((room_id, event_id))
+        return StoredMessage(*row)
+
+    def get_original_id(self, room_id: str, event_id: str) -> Optional[str]:
+        """
+        :return: The ID of the event replaced by this event, the ID of this
+            event if it is not a correction, or None if it is unknown
+        """
+        message = self.get_message(room_id, event_id)
+        if message is None:
+            return None
+        return message.original_id or message.event_id
+
+    def set_account_data(self, type_: str, content: dict):
+        if self.__batches:
+            self.__account_data[type_] = content
+            return
+        with self.__db:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO account_data VALUES (?, ?)",
+                (type_, json.dumps(content)),
+            )
+
+    def get_account_data(self, type_: str) -> Optional[dict]:
+        if type_ in self.__account_data:
+            return self.__account_data[type_]
+        row = self.__db.execute(
+            "SELECT content FROM account_data WHERE type = ?", (type_,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def stats(self) -> dict[str, int]:
+        (messages,) = self.__db.execute("SELECT COUNT(*) FROM message").fetchone()
+        return {"messages": messages}
+
+
+log = logging.getLogger(__name__)
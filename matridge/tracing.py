@@ -0,0 +1,128 @@
+"""
+Lightweight tracing of the XMPP → matrix path, to find out where the time goes
+when sending messages to matrix is slow.
+
+A sampled fraction of the calls to functions decorated with :func:`traced`
+become traces, made of the :func:`span` entered while they run. The duration
+of each stage ends up in the metrics, and finished traces are kept in memory
+and optionally appended to a JSON lines file.
+"""
+
+import json
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import NamedTuple, Optional
+
+from . import config
+from .metrics import metrics
+from .monitor import entry_point
+from .profiling import profiled
+
+
+class Span(NamedTuple):
+    name: str
+    # relative to the start of the trace, in seconds
+    start: float
+    duration: float
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans = list[Span]()
+        self.error: Optional[str] = None
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "error": self.error,
+            "spans": [s._asdict() for s in self.spans],
+        }
+
+
+class Collector:
+    """
+    Keeps the most recent traces, and exports finished ones.
+    """
+
+    def __init__(self, size=1000):
+        self.traces = deque[Trace](maxlen=size)
+
+    def add(self, trace: Trace):
+        self.traces.append(trace)
+        metrics.observe_stage(trace.name, trace.duration)
+        for s in trace.spans:
+            metrics.observe_stage(f"{trace.name}.{s.name}", s.duration)
+        if config.TRACE_FILE:
+            try:
+                with open(config.TRACE_FILE, "a") as f:
+                    f.write(json.dumps(trace.to_dict()) + "\n")
+            except OSError as e:
+                log.warning("Could not write trace to %s: %r", config.TRACE_FILE, e)
+
+
+def traced(func):
+    """
+    Start a trace for a sampled fraction of the calls to this coroutine
+    function. When called while a trace is running, it becomes a span of this
+    trace instead.
+    """
+
+    @wraps(func)
+    async def wrapped(*a, **kw):
+        if _current.get() is not None:
+            with span(func.__name__):
+                return await func(*a, **kw)
+
+        if random.random() >= config.TRACE_SAMPLE_RATE:
+            return await func(*a, **kw)
+
+        trace = Trace(func.__name__)
+        token = _current.set(trace)
+        try:
+            return await func(*a, **kw)
+        except Exception as e:
+            trace.error = repr(e)
+            raise
+        finally:
+            _current.reset(token)
+            trace.finish()
+            collector.add(trace)
+
+    return profiled(entry_point(wrapped))
+
+
+@contextmanager
+def span(name: str):
+    """
+    Measure a stage of the current trace. Does nothing if there is no running
+    trace.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        trace.spans.append(Span(name, start - trace.start, end - start))
+
+
+_current = ContextVar[Optional[Trace]]("trace", default=None)
+collector = Collector()
+log = logging.getLogger(__name__)
@@ -95,6 +95,17 @@ class MatrixMixin(MessageMixin):
     ):
         self.log.debug("Message: %s", msg.source)
 
+        if id_and_body := get_new_text(msg):
+            replace, body = id_and_body
+            kwargs = dict(
+                archive_only=archive_only,
+                when=server_timestamp_to_datetime(msg),
+                correction_event_id=msg.event_id,
+            )
+            await self.__add_reply_to(msg, replace, kwargs)
+            await self.send_files([], replace, body=body, thread=replace, **kwargs)
+            return
+
         if id_and_new := get_new_message(msg):
             replace, new = id_and_new
             return await self.send_matrix_message(
@@ -118,6 +129,9 @@ class MatrixMixin(MessageMixin):
         )
 
 
+TEXT_MSGTYPES = frozenset(["m.text", "m.notice", "m.emote"])
+
+
 def strip_reply_fallback(formatted_body: str) -> str:
     obj = bs4.BeautifulSoup(formatted_body, "html.parser")
     if mx_reply := obj.find("mx-reply"):
@@ -173,6 +187,32 @@ def get_new_message(msg: nio.RoomMessage):
     )
 
 
+def get_new_text(msg: nio.RoomMessage) -> Optional[tuple[str, str]]:
+    """
+    Fast path for text edits: get the new body directly from "m.new_content",
+    without building (and validating) a new nio event like
+    :func:`get_new_message` does.
+
+    :return: The ID of the replaced event and the new body, or None if this
+        is not a text edit, in which case :func:`get_new_message` should be used.
+    """
+    replace = get_rel(msg.source, "m.replace")
+    if not replace:
+        return None
+    new_content = get_new_content(msg.source)
+    if not isinstance(new_content, dict) or "m.relates_to" in new_content:
+        return None
+    msgtype = new_content.get("msgtype")
+    if msgtype not in TEXT_MSGTYPES:
+        return None
+    body = new_content.get("body")
+    if not isinstance(body, str):
+        return None
+    if msgtype == "m.emote":
+        body = "/me " + body
+    return replace, body
+
+
 def get_body(msg: nio.RoomMessage):
     if (
         isinstance(msg, nio.RoomMessageFormatted)
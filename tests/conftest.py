@@ -0,0 +1,60 @@
+import pytest
+import pytest_asyncio
+from slidge import (
+    BaseGateway,
+    BaseSession,
+    LegacyBookmarks,
+    LegacyContact,
+    LegacyMUC,
+    LegacyParticipant,
+    LegacyRoster,
+    user_store,
+)
+
+from matridge import config, contact, gateway, group
+from matridge import session as session_module
+from matridge.fake_homeserver import FakeHomeserver
+from matridge.loadtest import NullTransport, log_in, setup_gateway
+
+
+@pytest_asyncio.fixture
+async def homeserver():
+    async with FakeHomeserver() as server:
+        yield server
+
+
+@pytest.fixture
+def slidge_globals(monkeypatch):
+    """
+    Let a test set up a gateway with loadtest.setup_gateway(). The test must
+    close slidge's user store when it is done.
+    """
+    monkeypatch.setattr(config, "LOOP_LAG_THRESHOLD", 0)
+    # slidge's own test case (test_base.py) unregisters them when it ends
+    BaseGateway._subclass = gateway.Gateway
+    BaseSession._subclass = session_module.Session
+    LegacyRoster._subclass = contact.Roster
+    LegacyContact._subclass = contact.Contact
+    LegacyBookmarks._subclass = group.Bookmarks
+    LegacyMUC._subclass = group.MUC
+    LegacyParticipant._subclass = group.Participant
+    yield
+    # slidge's user store can only be set up once
+    user_store._users = None
+
+
+@pytest_asyncio.fixture
+async def session(homeserver: FakeHomeserver, tmp_path, slidge_globals):
+    """
+    A matridge session logged in as @alice:localhost, whose sync loop is
+    stopped: tests make its client sync when they want to.
+    """
+    homeserver.register("alice")
+    xmpp = setup_gateway(tmp_path, NullTransport())
+    session = await log_in(xmpp, homeserver, "alice")
+    session.matrix.stop_listen()
+    yield session
+    await session.matrix.close()
+    session.matrix.event_store.close()
+    xmpp._run_out_filters.cancel()
+    user_store.close()
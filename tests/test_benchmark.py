@@ -0,0 +1,205 @@
+"""
+Micro-benchmarks for the functions every message goes through.
+
+They run offline as part of the regular test suite. Use ``pytest -s`` to see
+the per-call report, and the ``MATRIDGE_BENCH_ITERATIONS`` environment variable
+to make the measurements more (or less) precise.
+"""
+
+import os
+import time
+import tracemalloc
+
+import nio
+import pytest
+
+from matridge.util import (
+    get_body,
+    get_content,
+    get_new_message,
+    get_new_text,
+    get_rel,
+    get_reply_to,
+    server_timestamp_to_datetime,
+)
+
+ITERATIONS = int(os.getenv("MATRIDGE_BENCH_ITERATIONS", 200))
+
+# generous upper bounds, in microseconds per call; we want to catch
+# order-of-magnitude regressions, not to make CI flaky
+BUDGET_US = 2_000
+
+
+def event(content: dict, **kwargs) -> dict:
+    return {
+        "content": content,
+        "origin_server_ts": 1689102822908,
+        "sender": "@someone:example.org",
+        "type": "m.room.message",
+        "unsigned": {"age": 710},
+        "event_id": "$event",
+        "room_id": "!room:example.org",
+        **kwargs,
+    }
+
+
+REPLY_FALLBACK = (
+    '<mx-reply><blockquote><a href="https://matrix.to/#/!room:example.org/$original'
+    '?via=example.org">In reply to</a> <a href="https://matrix.to/#/@other:example.org">'
+    "@other:example.org</a><br>what do you think?</blockquote></mx-reply>"
+)
+
+EVENTS = {
+    "plain": event({"msgtype": "m.text", "body": "hello there, how are you?"}),
+    "formatted": event(
+        {
+            "msgtype": "m.text",
+            "body": "some *bold* and `code`",
+            "format": "org.matrix.custom.html",
+            "formatted_body": "some <strong>bold</strong> and <code>code</code>",
+        }
+    ),
+    "reply": event(
+        {
+            "msgtype": "m.text",
+            "body": "> <@other:example.org> what do you think?\n\nsounds good",
+            "format": "org.matrix.custom.html",
+            "formatted_body": REPLY_FALLBACK + "sounds good",
+            "m.relates_to": {"m.in_reply_to": {"event_id": "$original"}},
+        }
+    ),
+    "thread": event(
+        {
+            "msgtype": "m.text",
+            "body": "in a thread",
+            "m.relates_to": {
+                "rel_type": "m.thread",
+                "event_id": "$root",
+                "is_falling_back": True,
+                "m.in_reply_to": {"event_id": "$root"},
+            },
+        }
+    ),
+    "edit": event(
+        {
+            "msgtype": "m.text",
+            "body": " * sounds great",
+            "format": "org.matrix.custom.html",
+            "formatted_body": REPLY_FALLBACK + " * sounds great",
+            "m.new_content": {
+                "msgtype": "m.text",
+                "body": "sounds great",
+                "format": "org.matrix.custom.html",
+                "formatted_body": "sounds <em>great</em>",
+            },
+            "m.relates_to": {"rel_type": "m.replace", "event_id": "$original"},
+        }
+    ),
+    "emote": event({"msgtype": "m.emote", "body": "waves"}),
+    "media": event(
+        {
+            "msgtype": "m.image",
+            "body": "cat.jpg",
+            "url": "mxc://example.org/abcdef",
+            "info": {"mimetype": "image/jpeg", "size": 31337, "w": 640, "h": 480},
+        }
+    ),
+    "media_edit": event(
+        {
+            "msgtype": "m.image",
+            "body": " * dog.jpg",
+            "url": "mxc://example.org/abcdef",
+            "m.new_content": {
+                "msgtype": "m.image",
+                "body": "dog.jpg",
+                "url": "mxc://example.org/ghijkl",
+            },
+            "m.relates_to": {"rel_type": "m.replace", "event_id": "$original"},
+        }
+    ),
+}
+
+PARSED = {k: nio.Event.parse_event(v) for k, v in EVENTS.items()}
+
+TEXTS = {
+    "plain": "hello there, how are you?",
+    "styled": "_underline_ *bold* ~strike~ `code`\n>quote\n```\nblock\n```",
+    "emote": "/me waves",
+    "long": "lorem ipsum *dolor* sit amet " * 100,
+}
+
+
+def bench(func, *args) -> tuple[float, float]:
+    """
+    :return: mean latency in microseconds and mean allocated bytes, per call
+    """
+    func(*args)  # warm-up
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func(*args)
+    latency = (time.perf_counter() - start) / ITERATIONS * 1_000_000
+
+    # measured separately, because tracing allocations slows everything down
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(min(ITERATIONS, 50)):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            func(*args)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+    finally:
+        tracemalloc.stop()
+    return latency, total / min(ITERATIONS, 50)
+
+
+@pytest.fixture
+def report(request):
+    def report(func, *args):
+        latency, allocated = bench(func, *args)
+        # only shown with pytest -s
+        print(
+            f"\n{request.node.name:<60} "
+            f"{latency:>10.2f} µs/call {allocated:>10.0f} B/call",
+            end="",
+        )
+        assert latency < BUDGET_US
+        return latency, allocated
+
+    return report
+
+
+@pytest.mark.parametrize("name", PARSED)
+def test_get_body(report, name):
+    report(get_body, PARSED[name])
+
+
+@pytest.mark.parametrize("name", ["edit", "media_edit", "plain"])
+def test_get_new_message(report, name):
+    report(get_new_message, PARSED[name])
+
+
+@pytest.mark.parametrize("name", ["edit", "media_edit", "plain"])
+def test_get_new_text(report, name):
+    report(get_new_text, PARSED[name])
+
+
+@pytest.mark.parametrize("name", ["reply", "thread", "plain"])
+def test_get_reply_to(report, name):
+    report(get_reply_to, EVENTS[name])
+
+
+@pytest.mark.parametrize("name", ["thread", "edit", "plain"])
+def test_get_rel(report, name):
+    report(get_rel, EVENTS[name], "m.thread")
+
+
+@pytest.mark.parametrize("name", TEXTS)
+def test_get_content(report, name):
+    report(get_content, TEXTS[name])
+
+
+def test_server_timestamp_to_datetime(report):
+    report(server_timestamp_to_datetime, PARSED["plain"])
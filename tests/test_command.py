@@ -0,0 +1,50 @@
+import pytest
+
+from matridge.command import ListSpaces
+from matridge.fake_homeserver import FakeHomeserver
+from matridge.session import Session
+
+
+@pytest.mark.asyncio
+async def test_list_spaces(homeserver: FakeHomeserver, session: Session):
+    me = session.matrix.user_id
+    bob = homeserver.register("bob")
+    space = homeserver.create_room(bob, name="Space", members=[me])
+    sub_space = homeserver.create_room(bob, name="Sub-space", members=[me])
+    used = homeserver.create_room(bob, name="Used", members=[me])
+    unused = homeserver.create_room(bob, name="Unused", members=[me])
+    not_joined = homeserver.create_room(bob, name="Not joined")
+    for parent, child in (
+        (space, sub_space),
+        (space, used),
+        (space, unused),
+        (space, not_joined),
+        (sub_space, used),
+    ):
+        homeserver.set_state(
+            parent, bob, "m.space.child", {"via": ["localhost"]}, child
+        )
+    await session.matrix.sync(full_state=True)
+    muc = await session.bookmarks.by_legacy_id(used)
+    # the sync created MUCs for all the rooms, as if they had been used
+    session.bookmarks.remove(await session.bookmarks.by_legacy_id(unused))
+    assert session.bookmarks.get_known(unused) is None
+
+    command = ListSpaces(session.xmpp)
+    form = await command.run(session, None)
+    spaces = [o["label"] for o in form.fields[0].options]
+    assert spaces == ["Space", "Sub-space"]
+    (space_room,) = (r for r in form.handler_args[0] if r.room_id == space)
+
+    table = await command.finish({"space": "0"}, session, None, [space_room])
+
+    assert table.items == [
+        {
+            "name": "Unused",
+            "jid": f"{await session.bookmarks.legacy_id_to_jid_local_part(unused)}"
+            f"@{session.xmpp.boundjid}",
+        },
+        {"name": "Used", "jid": muc.jid.bare},
+    ]
+    # not created by listing it
+    assert session.bookmarks.get_known(unused) is None
@@ -1,6 +1,6 @@
 import nio
 
-from matridge.util import strip_reply_fallback, get_body
+from matridge.util import get_body, get_new_message, get_new_text, strip_reply_fallback
 
 
 def test_reply_to():
@@ -117,3 +117,57 @@ def test_notice():
         get_body(event)
         == "**[tulir/whatsmeow]** tulir pushed [1 commit](https://github.com/tulir/whatsmeow/compare/6e8b189f1308...93091c7024da) to main:\n● `93091c70` Fix decrypting message secret reactions"
     )
+
+
+def test_get_new_text():
+    def edit(new_content):
+        return nio.Event.parse_event(
+            {
+                "content": {
+                    "body": " * whatever",
+                    "msgtype": "m.text",
+                    "m.new_content": new_content,
+                    "m.relates_to": {"event_id": "original", "rel_type": "m.replace"},
+                },
+                "origin_server_ts": 1688997470785,
+                "sender": "@someone:matrix.org",
+                "type": "m.room.message",
+                "event_id": "edit",
+            }
+        )
+
+    for new_content in (
+        {"body": "plain", "msgtype": "m.text"},
+        {
+            "body": "*formatted*",
+            "format": "org.matrix.custom.html",
+            "formatted_body": "<strong>formatted</strong>",
+            "msgtype": "m.text",
+        },
+        {"body": "waves", "msgtype": "m.emote"},
+        {"body": "beep", "msgtype": "m.notice"},
+    ):
+        event = edit(new_content)
+        replace, new = get_new_message(event)
+        assert get_new_text(event) == (replace, get_body(new))
+
+    assert get_new_text(edit({"body": "waves", "msgtype": "m.emote"}))[1] == "/me waves"
+    assert (
+        get_new_text(edit({"body": "x.jpg", "msgtype": "m.image", "url": "mxc://x/y"}))
+        is None
+    )
+    assert get_new_text(edit(None)) is None
+    assert (
+        get_new_text(
+            nio.Event.parse_event(
+                {
+                    "content": {"body": "not an edit", "msgtype": "m.text"},
+                    "origin_server_ts": 1688997470785,
+                    "sender": "@someone:matrix.org",
+                    "type": "m.room.message",
+                    "event_id": "edit",
+                }
+            )
+        )
+        is None
+    )
@@ -0,0 +1,113 @@
+import os
+import time
+from contextlib import nullcontext
+
+import pytest
+from nio.crypto import (
+    InboundGroupSession,
+    OlmAccount,
+    OlmDevice,
+    OutboundGroupSession,
+    TrustState,
+)
+from nio.exceptions import OlmTrustError
+from nio.store import DefaultStore, Ed25519Key
+
+from matridge.crypto_store import CryptoStore
+
+ITERATIONS = int(os.getenv("MATRIDGE_BENCH_ITERATIONS", 200))
+
+
+def device(i: int) -> OlmDevice:
+    return OlmDevice(f"@user{i % 3}:x", f"DEVICE{i}", {"ed25519": f"key{i}"})
+
+
+def test_set_trust_states(tmp_path):
+    store = CryptoStore("@me:x", "ME", str(tmp_path))
+    devices = [device(i) for i in range(10)]
+    store.blacklist_device(devices[0])
+
+    changed = store.set_trust_states(devices[:5], TrustState.verified)
+    assert changed == devices[:5]
+    assert all(d.trust_state == TrustState.verified for d in devices[:5])
+    assert store.set_trust_states(devices[:5], TrustState.verified) == []
+    assert store.set_trust_states(devices[4:6], TrustState.ignored) == devices[4:6]
+
+    store = CryptoStore("@me:x", "ME", str(tmp_path))
+    assert store.is_device_verified(devices[0])
+    assert not store.is_device_blacklisted(devices[0])
+    assert store.is_device_verified(devices[3])
+    assert not store.is_device_verified(devices[4])
+    assert store.is_device_ignored(devices[5])
+    assert list(store.trust_db) == [
+        Ed25519Key(d.user_id, d.id, d.ed25519) for d in devices[:4]
+    ]
+
+    impostor = OlmDevice(devices[1].user_id, devices[1].id, {"ed25519": "other"})
+    with pytest.raises(OlmTrustError):
+        store.set_trust_states([impostor], TrustState.verified)
+    assert impostor.trust_state == TrustState.unset
+
+
+def test_batch(tmp_path):
+    store = CryptoStore("@me:x", "ME", str(tmp_path))
+    other = CryptoStore("@other:x", "OTHER", str(tmp_path))
+    store.save_account(OlmAccount())
+    other.save_account(OlmAccount())
+    with store.batch():
+        store.save_sync_token("s1")
+        with store.batch():
+            store.save_sync_token("s2")
+        # models are bound to the store that last used them
+        other.save_sync_token("o1")
+        assert store.database.in_transaction()
+        store.save_sync_token("s3")
+    assert not store.database.in_transaction()
+    with pytest.raises(ValueError):
+        with store.batch():
+            store.save_sync_token("s4")
+            raise ValueError
+    assert CryptoStore("@me:x", "ME", str(tmp_path)).load_sync_token() == "s3"
+    assert other.load_sync_token() == "o1"
+
+
+def test_key_churn(tmp_path):
+    """
+    What nio writes while handling the to-device events of sync responses
+    bringing new megolm keys. Use ``pytest -s`` to see the durations.
+    """
+    account = OlmAccount()
+    keys = [
+        InboundGroupSession(
+            OutboundGroupSession().session_key,
+            account.identity_keys["ed25519"],
+            account.identity_keys["curve25519"],
+            f"!room{i}:x",
+        )
+        for i in range(ITERATIONS)
+    ]
+
+    def churn(store: DefaultStore, batch) -> float:
+        store.save_account(account)
+        start = time.perf_counter()
+        for i in range(0, len(keys), 10):
+            store.save_sync_token(f"s{i}")
+            with batch():
+                for key in keys[i : i + 10]:
+                    store.save_inbound_group_session(key)
+                store.save_account(account)
+        return time.perf_counter() - start
+
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    default = churn(DefaultStore("@me:x", "ME", str(tmp_path / "a")), nullcontext)
+    store = CryptoStore("@me:x", "ME", str(tmp_path / "b"))
+    tuned = churn(store, store.batch)
+    print(
+        f"\n{ITERATIONS} megolm keys: {default:.3f}s with nio's store, "
+        f"{tuned:.3f}s with CryptoStore"
+    )
+    assert len(list(store.load_inbound_group_sessions())) == ITERATIONS
+    # about twice as fast, whatever the disk, because most of the time is
+    # spent binding nio's models
+    assert tuned < default
@@ -0,0 +1,110 @@
+import asyncio
+import io
+
+import nio
+import pytest
+import pytest_asyncio
+
+from matridge.fake_homeserver import FakeHomeserver
+
+
+@pytest_asyncio.fixture
+async def server():
+    async with FakeHomeserver() as server:
+        yield server
+
+
+@pytest_asyncio.fixture
+async def client(server: FakeHomeserver):
+    server.register("alice")
+    client = nio.AsyncClient(server.url, "alice")
+    resp = await client.login("password")
+    assert isinstance(resp, nio.LoginResponse)
+    yield client
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_login(server: FakeHomeserver, client: nio.AsyncClient):
+    assert client.user_id == "@alice:localhost"
+    other = nio.AsyncClient(server.url, "alice")
+    assert isinstance(await other.login("nope"), nio.LoginError)
+    await other.close()
+
+
+@pytest.mark.asyncio
+async def test_sync_and_send(server: FakeHomeserver, client: nio.AsyncClient):
+    bob = server.register("bob", displayname="Bob")
+    room_id = server.create_room(bob, name="Room", members=[client.user_id])
+    server.send_text(room_id, bob, "hello")
+
+    resp = await client.sync(full_state=True)
+    assert isinstance(resp, nio.SyncResponse)
+    room = client.rooms[room_id]
+    assert room.name == "Room"
+    assert set(room.users) == {bob, client.user_id}
+    timeline = resp.rooms.join[room_id].timeline.events
+    assert timeline[-1].body == "hello"
+
+    resp = await client.room_send(
+        room_id, "m.room.message", {"msgtype": "m.text", "body": "hi"}
+    )
+    assert isinstance(resp, nio.RoomSendResponse)
+    event = await client.room_get_event(room_id, resp.event_id)
+    assert isinstance(event, nio.RoomGetEventResponse)
+    assert event.event.body == "hi"
+
+    resp = await client.sync(timeout=0)
+    assert [e.body for e in resp.rooms.join[room_id].timeline.events] == ["hi"]
+
+
+@pytest.mark.asyncio
+async def test_long_poll(server: FakeHomeserver, client: nio.AsyncClient):
+    bob = server.register("bob")
+    room_id = server.create_room(bob, members=[client.user_id])
+    await client.sync(full_state=True)
+
+    async def later():
+        await asyncio.sleep(0.05)
+        server.set_typing(room_id, [bob])
+
+    asyncio.create_task(later())
+    resp = await client.sync(timeout=5_000)
+    (typing,) = resp.rooms.join[room_id].ephemeral
+    assert typing.users == [bob]
+
+
+@pytest.mark.asyncio
+async def test_room_messages(server: FakeHomeserver, client: nio.AsyncClient):
+    bob = server.register("bob")
+    room_id = server.create_room(bob, members=[client.user_id])
+    msg = server.send_text(room_id, bob, "hello")
+    server.react(room_id, bob, msg, "<3")
+    sync = await client.sync(full_state=True)
+
+    resp = await client.room_messages(room_id, start=sync.next_batch, limit=2)
+    assert isinstance(resp.chunk[0], nio.ReactionEvent)
+    assert isinstance(resp.chunk[1], nio.RoomMessageText)
+
+    resp = await client.room_messages(
+        room_id,
+        start=sync.next_batch,
+        message_filter={"types": ["m.reaction"]},
+    )
+    assert len(resp.chunk) == 1
+
+
+@pytest.mark.asyncio
+async def test_media_and_profile(server: FakeHomeserver, client: nio.AsyncClient):
+    resp, _ = await client.upload(io.BytesIO(b"data"), "text/plain", "file.txt")
+    assert isinstance(resp, nio.UploadResponse)
+    download = await client.download(mxc=resp.content_uri)
+    assert download.body == b"data"
+
+    profile = await client.get_profile(client.user_id)
+    assert profile.displayname == "alice"
+
+    bob = server.register("bob", displayname="Bob")
+    room_id = server.create_room(bob, members=[client.user_id])
+    members = await client.joined_members(room_id)
+    assert {m.user_id for m in members.members} == {bob, client.user_id}
@@ -0,0 +1,46 @@
+import gc
+import weakref
+
+import pytest
+
+from matridge import config
+from matridge.matrix import instance_cache
+
+
+class Client:
+    def __init__(self):
+        self.calls = 0
+
+    @instance_cache(lambda: config.EVENT_CACHE_SIZE)
+    async def get(self, key: str) -> str:
+        self.calls += 1
+        return key + "!"
+
+
+@pytest.mark.asyncio
+async def test_per_instance(monkeypatch):
+    monkeypatch.setattr(config, "EVENT_CACHE_SIZE", 2)
+    a, b = Client(), Client()
+    assert await a.get("x") == "x!"
+    assert await a.get("x") == "x!"
+    assert await b.get("x") == "x!"
+    assert a.calls == b.calls == 1
+    info = a.get.cache_info()
+    assert (info.hits, info.misses, info.maxsize) == (1, 1, 2)
+
+    await a.get("y")
+    await a.get("z")
+    assert a.get.cache_info().currsize == 2
+    a.get.cache_clear()
+    assert a.get.cache_info().currsize == 0
+    assert b.get.cache_info().currsize == 1
+
+
+@pytest.mark.asyncio
+async def test_freed():
+    client = Client()
+    await client.get("x")
+    ref = weakref.ref(client)
+    del client
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,36 @@
+import pytest
+from slidge import global_config
+
+from matridge.loadtest import LoadTest, Stats, percentile
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0
+    values = [float(i) for i in range(100, 0, -1)]
+    assert percentile(values, 0.5) == 51
+    assert percentile(values, 0.99) == 100
+    assert percentile([1.0], 0.99) == 1
+
+
+def test_report():
+    stats = Stats()
+    stats.inbound.extend([0.01, 0.02, 0.03, 0.04])
+    stats.lag.append(0.005)
+    report = stats.report(10, 2, 8)
+    assert report["inbound_per_s"] == 2
+    assert report["stanzas_per_s"] == 4
+    assert report["inbound_p50_ms"] == 30
+    assert report["lag_max_ms"] == 5
+    assert report["rss_mb"] > 0
+
+
+@pytest.mark.asyncio
+async def test_run(slidge_globals):
+    load = LoadTest(users=2, rooms=2, messages=40, reactions=0, typing=0, sends=10)
+    reports = [report async for report in load.run(1, 0.5)]
+    assert reports[0]["logged_in"] == 2
+    # the messages went through the homeserver, matridge's clients and slidge
+    assert sum(report["inbound_per_s"] for report in reports[1:]) > 0
+    assert sum(report["outbound_per_s"] for report in reports[1:]) > 0
+    assert all(report["errors"] == 0 for report in reports[1:])
+    assert not global_config.HOME_DIR.exists()
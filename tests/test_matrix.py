@@ -0,0 +1,249 @@
+import asyncio
+
+import nio
+import pytest
+import pytest_asyncio
+
+from matridge.fake_homeserver import FakeHomeserver
+from matridge.group import Participant
+from matridge.session import Session
+
+
+@pytest_asyncio.fixture
+async def room(homeserver: FakeHomeserver, session: Session) -> nio.MatrixRoom:
+    bob = homeserver.register("bob")
+    homeserver.register("carol")
+    room_id = homeserver.create_room(
+        bob, members=[session.matrix.user_id, "@carol:localhost"]
+    )
+    await session.matrix.sync(full_state=True)
+    return session.matrix.rooms[room_id]
+
+
+def record(monkeypatch, *methods: str) -> list[tuple]:
+    """
+    Record the calls to these methods of participants, as (method, matrix
+    user ID, *args).
+    """
+    calls = list[tuple]()
+    for name in methods:
+
+        def recorder(self: Participant, *a, name=name, **_kw):
+            calls.append((name, self.contact.legacy_id, *a))
+
+        monkeypatch.setattr(Participant, name, recorder)
+    return calls
+
+
+def receipts(*receipts: tuple[str, str]) -> nio.ReceiptEvent:
+    """
+    :param receipts: (user ID, event ID)
+    """
+    return nio.ReceiptEvent(
+        [nio.Receipt(event_id, "m.read", user_id, 0) for user_id, event_id in receipts]
+    )
+
+
+@pytest.mark.asyncio
+async def test_receipts(
+    homeserver: FakeHomeserver, session: Session, room: nio.MatrixRoom, monkeypatch
+):
+    client = session.matrix
+    bob, carol = "@bob:localhost", "@carol:localhost"
+    m1, m2, m3, m4 = (
+        homeserver.send(
+            room.room_id, bob, {"msgtype": "m.text", "body": "hi"}, origin_server_ts=ts
+        )
+        for ts in (1000, 2000, 3000, 4000)
+    )
+    await client.sync()
+    calls = record(monkeypatch, "displayed")
+
+    await client.on_receipt(room, receipts((bob, m2)))
+    assert calls == [("displayed", bob, m2)]
+
+    calls.clear()
+    # the same event, and an older one
+    await client.on_receipt(room, receipts((bob, m2)))
+    await client.on_receipt(room, receipts((bob, m1)))
+    assert calls == []
+
+    # only the last one of each user in a batch
+    await client.on_receipt(room, receipts((bob, m3), (carol, m1), (bob, m4)))
+    assert calls == [("displayed", bob, m4), ("displayed", carol, m1)]
+
+    calls.clear()
+    # without a timestamp to compare, the receipt may be more recent
+    await client.on_receipt(room, receipts((bob, "$unknown")))
+    await client.on_receipt(room, receipts((bob, m1)))
+    assert calls == [("displayed", bob, "$unknown"), ("displayed", bob, m1)]
+
+
+@pytest.mark.asyncio
+async def test_typing(session: Session, room: nio.MatrixRoom, monkeypatch):
+    client = session.matrix
+    bob, carol = "@bob:localhost", "@carol:localhost"
+    calls = record(monkeypatch, "composing", "paused")
+
+    for typing in [bob], [bob], [bob, carol], [carol], []:
+        await client.on_typing(room, nio.TypingNoticeEvent(typing))
+
+    assert calls == [
+        ("composing", bob),
+        ("composing", carol),
+        ("paused", bob),
+        ("paused", carol),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metadata_once_per_sync(
+    homeserver: FakeHomeserver, session: Session, room: nio.MatrixRoom, monkeypatch
+):
+    client = session.matrix
+    bob = "@bob:localhost"
+    applied = []
+    on_name, on_topic = client.on_name, client.on_topic
+
+    async def record_name(room, event):
+        applied.append(event.name)
+        await on_name(room, event)
+
+    async def record_topic(room, event):
+        applied.append(event.topic)
+        await on_topic(room, event)
+
+    monkeypatch.setattr(client, "on_name", record_name)
+    monkeypatch.setattr(client, "on_topic", record_topic)
+    # e.g. after a downtime
+    homeserver.set_state(room.room_id, bob, "m.room.name", {"name": "First"})
+    homeserver.set_state(room.room_id, bob, "m.room.topic", {"topic": "Topic"})
+    homeserver.set_state(room.room_id, bob, "m.room.name", {"name": "Second"})
+    await client.sync()
+
+    assert sorted(applied) == ["Second", "Topic"]
+    muc = await session.bookmarks.by_legacy_id(room.room_id)
+    assert muc.name == "Second"
+    assert muc.subject == "Topic"
+
+
+@pytest.mark.asyncio
+async def test_known_contacts(homeserver: FakeHomeserver, session: Session):
+    dave = homeserver.register("dave")
+    assert not session.contacts.is_known(dave)
+    contact = await session.contacts.by_legacy_id(dave)
+    assert session.contacts.is_known(dave)
+    assert await session.contacts.by_jid(contact.jid) is contact
+
+
+@pytest.mark.asyncio
+async def test_presence_visibility(
+    homeserver: FakeHomeserver, session: Session, room: nio.MatrixRoom, monkeypatch
+):
+    def presence(user_id: str):
+        return nio.PresenceEvent(user_id, "online", 0, True, None)
+
+    # only the MUC participants are visible
+    monkeypatch.setattr(session.contacts, "is_known", lambda _: False)
+    forward = session.matrix.presences.forward
+    if muc := session.bookmarks.get_known(room.room_id):
+        session.bookmarks.remove(muc)
+    assert not await forward(presence("@carol:localhost"))
+    await session.bookmarks.by_legacy_id(room.room_id)
+    assert await forward(presence("@carol:localhost"))
+
+    erin = homeserver.register("erin")
+    assert not await forward(presence(erin))
+    homeserver.join_room(room.room_id, erin)
+    await session.matrix.sync()
+    assert await forward(presence(erin))
+
+
+class FakeOlm:
+    def __init__(self):
+        self.should_query_keys = False
+        # IDs of the rooms that need a new group session
+        self.share = set[str]()
+
+    def should_share_group_session(self, room_id: str) -> bool:
+        return room_id in self.share
+
+
+@pytest.mark.asyncio
+async def test_prepare_encryption(session: Session, room: nio.MatrixRoom, monkeypatch):
+    client = session.matrix
+    calls = list[tuple]()
+    release = asyncio.Event()
+    release.set()
+
+    async def joined_members(room_id: str):
+        calls.append(("members", room_id))
+        room.members_synced = True
+
+    async def keys_query():
+        calls.append(("keys",))
+        olm.should_query_keys = False
+
+    async def share_group_session(room_id: str):
+        calls.append(("share", room_id))
+        await release.wait()
+        if room_id == "!fail":
+            raise ValueError
+
+    monkeypatch.setattr(client, "joined_members", joined_members)
+    monkeypatch.setattr(client, "keys_query", keys_query)
+    monkeypatch.setattr(client, "share_group_session", share_group_session)
+
+    async def prepare(room_id=room.room_id):
+        client.prepare_encryption(room_id)
+        await asyncio.sleep(0.01)
+
+    olm = FakeOlm()
+    olm.should_query_keys = True
+    olm.share.add(room.room_id)
+    room.encrypted = True
+    room.members_synced = False
+    monkeypatch.setattr(client, "olm", None)
+    await prepare()
+    assert calls == [], "no encryption support"
+    monkeypatch.setattr(client, "olm", olm)
+    room.encrypted = False
+    await prepare()
+    assert calls == [], "the room is not encrypted"
+    room.encrypted = True
+    room.members_synced = True
+    olm.should_query_keys = False
+    olm.share.clear()
+    await prepare()
+    assert calls == [], "nothing to do"
+
+    room.members_synced = False
+    olm.should_query_keys = True
+    olm.share.add(room.room_id)
+    release.clear()
+    await prepare()
+    await prepare()
+    assert calls == [
+        ("members", room.room_id),
+        ("keys",),
+        ("share", room.room_id),
+    ], "one task per room"
+    # cancelled by stop_listen(), which does not affect the next preparation
+    client.stop_listen()
+    await prepare()
+    assert len(calls) == 4
+    await prepare()
+    assert len(calls) == 4, "one task per room"
+    release.set()
+    await asyncio.sleep(0.01)
+    await prepare()
+    assert len(calls) == 5
+
+    client.rooms["!fail"] = failing = nio.MatrixRoom("!fail", client.user_id)
+    failing.encrypted = failing.members_synced = True
+    olm.share.add("!fail")
+    await prepare("!fail")
+    assert calls[-1] == ("share", "!fail")
+    # only logged, and tried again the next time
+    await prepare("!fail")
+    assert calls[-2:] == [("share", "!fail")] * 2
@@ -0,0 +1,31 @@
+from matridge.metrics import Histogram, Metrics
+
+
+def test_histogram():
+    h = Histogram()
+    h.observe(0.001)
+    h.observe(0.005)
+    h.observe(0.2)
+    h.observe(1000)
+    assert h.count == 4
+    lines = h.render("x", 'handler="on_message"')
+    assert 'x_bucket{handler="on_message",le="0.005"} 2' in lines
+    assert 'x_bucket{handler="on_message",le="0.25"} 3' in lines
+    assert 'x_bucket{handler="on_message",le="+Inf"} 4' in lines
+    assert 'x_count{handler="on_message"} 4' in lines
+    assert "x_count 4" in h.render("x")
+
+
+def test_metrics(tmp_path):
+    m = Metrics()
+    m.observe_handler("on_message", 0.1, False)
+    m.observe_handler("on_message", 0.2, True)
+    m.observe_handler("on_typing", 0.01, False)
+    m.observe_delivery(1.5)
+    path = tmp_path / "metrics.prom"
+    m.write(path)
+    text = path.read_text()
+    assert 'matridge_handler_calls_total{handler="on_message"} 2' in text
+    assert 'matridge_handler_errors_total{handler="on_message"} 1' in text
+    assert 'matridge_handler_errors_total{handler="on_typing"} 0' in text
+    assert "matridge_delivery_delay_seconds_count 1" in text
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from functools import wraps
+
+import pytest
+from slidge import user_store
+from slixmpp import JID
+
+from matridge.metrics import metrics
+from matridge.monitor import LoopMonitor, entry_point
+
+
+def decorator(func):
+    @wraps(func)
+    async def wrapped(*a, **kw):
+        return await func(*a, **kw)
+
+    return entry_point(wrapped)
+
+
+@decorator
+async def slow_handler():
+    await asyncio.sleep(0)
+    blocking()
+
+
+def blocking():
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_stall():
+    monitor = LoopMonitor(threshold=0.1, interval=0.02)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+    assert not monitor.stalls
+
+    await slow_handler()
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    (stall,) = monitor.stalls
+    assert stall.handler == "slow_handler"
+    assert stall.session is None
+    assert "blocking" in stall.location
+    assert stall.duration > 0.25
+    assert monitor.max_lag > 0.25
+    assert metrics.stalls["slow_handler"] == 1
+
+
+@decorator
+async def outer_handler(session):
+    await inner_handler(session.matrix)
+
+
+@decorator
+async def inner_handler(client):
+    blocking()
+
+
+@pytest.mark.asyncio
+async def test_stall_session(session):
+    monitor = LoopMonitor(threshold=0.1, interval=0.02)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+
+    await outer_handler(session)
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    (stall,) = monitor.stalls
+    assert stall.handler == "outer_handler"
+    assert stall.session == "alice@localhost"
+
+
+@pytest.mark.asyncio
+async def test_sessions(session):
+    # registered, but without a session
+    user_store.add(JID("bob@localhost"), {})
+    assert session.xmpp.sessions() == [session]
@@ -0,0 +1,111 @@
+import asyncio
+
+import nio
+import pytest
+
+from matridge.presence import PresenceCoalescer
+
+
+def presence(user_id: str, state="online", active=True, status=None, ago=0):
+    return nio.PresenceEvent(user_id, state, ago, active, status)
+
+
+@pytest.mark.asyncio
+async def test_coalesce():
+    forwarded = list[nio.PresenceEvent]()
+
+    async def forward(event: nio.PresenceEvent):
+        forwarded.append(event)
+        return event.user_id != "@stranger"
+
+    coalescer = PresenceCoalescer(forward, 0)
+    coalescer.add(presence("@a", ago=1))
+    coalescer.add(presence("@a", "unavailable", False))
+    coalescer.add(presence("@b"))
+    coalescer.add(presence("@stranger"))
+    await asyncio.sleep(0.01)
+    assert [(p.user_id, p.presence) for p in forwarded] == [
+        ("@a", "unavailable"),
+        ("@b", "online"),
+        ("@stranger", "online"),
+    ]
+
+    forwarded.clear()
+    coalescer.add(presence("@a", "unavailable", False, ago=1000))
+    coalescer.add(presence("@b", status="busy"))
+    coalescer.add(presence("@stranger"))
+    await asyncio.sleep(0.01)
+    assert [(p.user_id, p.status_msg) for p in forwarded] == [
+        ("@b", "busy"),
+        ("@stranger", None),
+    ]
+    assert coalescer.stats() == {"users": 2, "pending": 0, "dropped": 3}
+
+
+@pytest.mark.asyncio
+async def test_back_to_forwarded_state():
+    forwarded = list[nio.PresenceEvent]()
+
+    async def forward(event: nio.PresenceEvent):
+        forwarded.append(event)
+        return True
+
+    coalescer = PresenceCoalescer(forward, 0)
+    coalescer.add(presence("@a"))
+    await asyncio.sleep(0.01)
+    coalescer.add(presence("@a", "unavailable", False))
+    coalescer.add(presence("@a"))
+    await asyncio.sleep(0.01)
+    assert len(forwarded) == 1
+    coalescer.clear()
+    coalescer.add(presence("@a"))
+    await asyncio.sleep(0.01)
+    assert len(forwarded) == 2
+
+
+@pytest.mark.asyncio
+async def test_presence_during_flush():
+    forwarded = list[nio.PresenceEvent]()
+    release = asyncio.Event()
+
+    async def forward(event: nio.PresenceEvent):
+        forwarded.append(event)
+        if event.user_id == "@a":
+            await release.wait()
+        return True
+
+    coalescer = PresenceCoalescer(forward, 0)
+    coalescer.add(presence("@a"))
+    coalescer.add(presence("@b"))
+    await asyncio.sleep(0.01)
+    assert [p.user_id for p in forwarded] == ["@a"]
+    # while @a's presence is being forwarded
+    coalescer.add(presence("@b", "unavailable", False))
+    coalescer.add(presence("@a", "unavailable", False))
+    coalescer.add(presence("@a"))
+    release.set()
+    await asyncio.sleep(0.01)
+    assert [(p.user_id, p.presence) for p in forwarded] == [
+        ("@a", "online"),
+        ("@b", "unavailable"),
+    ]
+    assert coalescer.stats() == {"users": 2, "pending": 0, "dropped": 1}
+
+
+@pytest.mark.asyncio
+async def test_clear_during_flush():
+    forwarded = list[nio.PresenceEvent]()
+
+    async def forward(event: nio.PresenceEvent):
+        forwarded.append(event)
+        await asyncio.sleep(0.02)
+        return True
+
+    coalescer = PresenceCoalescer(forward, 0)
+    coalescer.add(presence("@a"))
+    coalescer.add(presence("@b"))
+    await asyncio.sleep(0.01)
+    coalescer.clear()
+    coalescer.add(presence("@c"))
+    await asyncio.sleep(0.1)
+    assert [p.user_id for p in forwarded] == ["@a", "@c"]
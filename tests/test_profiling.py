@@ -0,0 +1,44 @@
+import asyncio
+import pstats
+from types import SimpleNamespace
+
+import pytest
+from slidge.core import config as global_config
+
+from matridge import profiling
+
+
+def work():
+    return sum(range(1000))
+
+
+def other_work():
+    return sum(range(1000))
+
+
+class Handler:
+    def __init__(self, jid: str):
+        self.session = SimpleNamespace(user=SimpleNamespace(bare_jid=jid))
+
+    @profiling.profiled
+    async def on_event(self, func):
+        await asyncio.sleep(0)
+        func()
+
+
+@pytest.mark.asyncio
+async def test_scoped_capture(tmp_path, monkeypatch):
+    monkeypatch.setattr(global_config, "HOME_DIR", tmp_path, raising=False)
+    path = profiling.start(0.1, "alice@example.com")
+    with pytest.raises(RuntimeError):
+        profiling.start(0.1)
+
+    await Handler("alice@example.com").on_event(work)
+    await Handler("bob@example.com").on_event(other_work)
+    await asyncio.sleep(0.2)
+
+    assert path.parent == tmp_path / "profiles"
+    functions = {f for _, _, f in pstats.Stats(str(path)).stats}  # type:ignore
+    assert "work" in functions
+    assert "other_work" not in functions
+    assert profiling._capture is None
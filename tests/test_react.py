@@ -0,0 +1,124 @@
+import asyncio
+
+import nio
+import pytest
+import pytest_asyncio
+from slixmpp.exceptions import XMPPError
+
+from matridge.fake_homeserver import FakeHomeserver
+from matridge.group import MUC
+from matridge.session import Session
+
+
+@pytest_asyncio.fixture
+async def message(homeserver: FakeHomeserver, session: Session):
+    """
+    A MUC, and the ID of a message in it to react to.
+    """
+    bob = homeserver.register("bob")
+    room_id = homeserver.create_room(bob, members=[session.matrix.user_id])
+    event_id = homeserver.send_text(room_id, bob, "hello")
+    await session.matrix.sync(full_state=True)
+    return await session.bookmarks.by_legacy_id(room_id), event_id
+
+
+async def reactions(session: Session, muc: MUC, event_id: str) -> dict[str, str]:
+    return await session.matrix.reactions.get(
+        muc.legacy_id, event_id, session.matrix.user_id, with_event_ids=True
+    )
+
+
+def slow_sends(session: Session, monkeypatch) -> list[int]:
+    """
+    :return: The number of reactions being sent, each time one starts
+    """
+    in_flight = [0]
+    counts = []
+    room_send = session.matrix.room_send
+
+    async def slow_send(*a, **kw):
+        in_flight[0] += 1
+        counts.append(in_flight[0])
+        await asyncio.sleep(0.01)
+        try:
+            return await room_send(*a, **kw)
+        finally:
+            in_flight[0] -= 1
+
+    monkeypatch.setattr(session.matrix, "room_send", slow_send)
+    return counts
+
+
+@pytest.mark.asyncio
+async def test_concurrency(
+    homeserver: FakeHomeserver, session: Session, message, monkeypatch
+):
+    muc, event_id = message
+    counts = slow_sends(session, monkeypatch)
+
+    await session.react(muc, event_id, list("abcdef"))
+
+    assert len(counts) == 6
+    assert max(counts) == Session.REACTION_CONCURRENCY
+    result = await reactions(session, muc, event_id)
+    assert set(result) == set("abcdef")
+    assert all(e in homeserver.events for e in result.values())
+
+
+@pytest.mark.asyncio
+async def test_rollback(
+    homeserver: FakeHomeserver, session: Session, message, monkeypatch
+):
+    muc, event_id = message
+    await session.react(muc, event_id, ["a", "b"])
+    before = await reactions(session, muc, event_id)
+
+    room_send = session.matrix.room_send
+    room_redact = session.matrix.room_redact
+
+    async def failing_send(room_id, message_type, content, **kw):
+        if content["m.relates_to"]["key"] == "c":
+            return nio.RoomSendError("nope")
+        return await room_send(room_id, message_type, content, **kw)
+
+    async def failing_redact(room_id, event_id, *a, **kw):
+        if event_id == before["a"]:
+            return nio.RoomRedactError("nope")
+        return await room_redact(room_id, event_id, *a, **kw)
+
+    monkeypatch.setattr(session.matrix, "room_send", failing_send)
+    monkeypatch.setattr(session.matrix, "room_redact", failing_redact)
+    with pytest.raises(XMPPError):
+        await session.react(muc, event_id, ["b", "c", "d"])
+
+    after = await reactions(session, muc, event_id)
+    assert set(after) == {"a", "b", "d"}
+    assert after["a"] == before["a"]
+    assert after["d"] in homeserver.events
+
+
+@pytest.mark.asyncio
+async def test_successive_changes(
+    homeserver: FakeHomeserver, session: Session, message, monkeypatch
+):
+    muc, event_id = message
+    slow_sends(session, monkeypatch)
+    redacted = []
+    room_redact = session.matrix.room_redact
+
+    async def recording_redact(room_id, event_id, *a, **kw):
+        redacted.append(event_id)
+        return await room_redact(room_id, event_id, *a, **kw)
+
+    monkeypatch.setattr(session.matrix, "room_redact", recording_redact)
+
+    # e.g. an XMPP client sending one reaction update after the other
+    await asyncio.gather(
+        session.react(muc, event_id, ["a"]), session.react(muc, event_id, ["b"])
+    )
+
+    result = await reactions(session, muc, event_id)
+    assert set(result) == {"b"}
+    # the reaction sent by the first change, not its placeholder
+    (redaction,) = redacted
+    assert homeserver.events[redaction]["type"] == "m.reaction"
@@ -121,3 +121,19 @@ async def test_fetch_add_remove():
     assert await cache.get(*target) == {"<3", "+1", "prout"}
     cache.remove("2")
     assert await cache.get(*target) == {"<3", "prout"}
+
+
+@pytest.mark.asyncio
+async def test_rename():
+    cache = ReactionCache(MockMatrix)
+    target = "good", "msg_id", "someone"
+    await cache.add(*target, "prout", "pending")
+    cache.rename("pending", "4")
+    assert await cache.get(*target, with_event_ids=True) == {
+        "<3": "1",
+        "+1": "2",
+        "prout": "4",
+    }
+    assert cache.remove("pending") is None
+    cache.remove("4")
+    assert await cache.get(*target) == {"<3", "+1"}
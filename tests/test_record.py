@@ -0,0 +1,68 @@
+import nio
+import pytest
+
+from matridge.fake_homeserver import FakeHomeserver
+from matridge.record import Anonymizer, SyncRecorder, load
+from matridge.replay import apply, count_events
+
+
+def test_anonymizer():
+    anonymize = Anonymizer(b"salt")
+    event = {
+        "event_id": "$abc",
+        "sender": "@bob:example.com",
+        "room_id": "!room:example.com",
+        "content": {
+            "body": "secret",
+            "url": "mxc://example.com/media",
+            "m.relates_to": {"event_id": "$def", "rel_type": "m.thread"},
+        },
+    }
+    result = anonymize(event)
+    assert result["content"]["body"] == "xxxxxx"
+    presence = anonymize({"content": {"presence": "online", "status_msg": "secret"}})
+    assert presence["content"] == {"presence": "online", "status_msg": "xxxxxx"}
+    member = anonymize({"content": {"membership": "ban", "reason": "secret"}})
+    assert member["content"] == {"membership": "ban", "reason": "xxxxxx"}
+    assert result["content"]["m.relates_to"]["rel_type"] == "m.thread"
+    assert result["sender"].endswith(":anon.invalid")
+    assert "example.com" not in str(result)
+    assert anonymize("@bob:example.com") == result["sender"]
+    assert anonymize({"@bob:example.com": 1}) == {result["sender"]: 1}
+    assert Anonymizer(b"other")("@bob:example.com") != result["sender"]
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(tmp_path):
+    async with FakeHomeserver() as server:
+        server.register("alice")
+        bob = server.register("bob")
+        room_id = server.create_room(bob, members=["@alice:localhost"])
+        server.send_text(room_id, bob, "hello")
+
+        client = nio.AsyncClient(server.url, "alice")
+        await client.login("password")
+        recorder = SyncRecorder(tmp_path / "rec.jsonl", client.user_id, True)
+        await recorder.record(await client.sync(full_state=True))
+        server.send_text(room_id, bob, "hello again")
+        await recorder.record(await client.sync())
+        await client.close()
+
+    user_id, responses = load(tmp_path / "rec.jsonl")
+    assert user_id.endswith(":anon.invalid")
+    assert len(responses) == 2
+    assert count_events(responses[1]) == 1
+
+    replayed = nio.AsyncClient("http://localhost", user_id)
+    received = []
+
+    async def callback(room, event):
+        received.append(event)
+
+    replayed.add_event_callback(callback, nio.RoomMessageText)
+    await apply(replayed, responses[0], callbacks=False)
+    assert len(replayed.rooms) == 1
+    assert not received
+    await apply(replayed, responses[1])
+    assert [e.body for e in received] == ["x" * len("hello again")]
+    await replayed.close()
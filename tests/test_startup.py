@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from matridge.startup import LoginScheduler
+
+
+@pytest.mark.asyncio
+async def test_limit():
+    scheduler = LoginScheduler(2)
+    running = 0
+    max_running = 0
+
+    async def login():
+        nonlocal running, max_running
+        async with scheduler.slot(lambda: False):
+            running += 1
+            max_running = max(running, max_running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(login() for _ in range(10)))
+    assert max_running == 2
+    assert scheduler.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_online_first():
+    scheduler = LoginScheduler(1)
+    online = set[str]()
+    order = list[str]()
+
+    async def login(user: str):
+        async with scheduler.slot(lambda: user in online):
+            order.append(user)
+            await asyncio.sleep(0.01)
+
+    tasks = [asyncio.create_task(login(u)) for u in "abcd"]
+    await asyncio.sleep(0)
+    # presence received while waiting
+    online.add("d")
+    await asyncio.gather(*tasks)
+    assert order == ["a", "d", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_cancel_while_waiting():
+    scheduler = LoginScheduler(1)
+    order = list[str]()
+
+    async def login(user: str):
+        async with scheduler.slot(lambda: False):
+            order.append(user)
+            await asyncio.sleep(0.01)
+
+    a = asyncio.create_task(login("a"))
+    b = asyncio.create_task(login("b"))
+    c = asyncio.create_task(login("c"))
+    await asyncio.sleep(0)
+    b.cancel()
+    await asyncio.gather(a, c)
+    assert order == ["a", "c"]
+    assert scheduler.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_no_limit():
+    scheduler = LoginScheduler(0)
+    async with scheduler.slot(lambda: False):
+        async with scheduler.slot(lambda: False):
+            pass
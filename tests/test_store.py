@@ -0,0 +1,116 @@
+import sqlite3
+
+import pytest
+
+from matridge.store import MIGRATIONS, EventStore, StoredMessage
+
+
+def test_messages(tmp_path):
+    store = EventStore(tmp_path / "test.db")
+    store.add_messages(
+        "!room",
+        [
+            StoredMessage("$msg", None, "$root", "@a:x", 1),
+            StoredMessage("$edit", "$msg", "$root", "@a:x", 2),
+        ],
+    )
+    assert store.get_original_id("!room", "$edit") == "$msg"
+    assert store.get_original_id("!room", "$msg") == "$msg"
+    assert store.get_original_id("!room", "$unknown") is None
+    assert store.get_original_id("!other", "$edit") is None
+    assert store.get_message("!room", "$edit") == StoredMessage(
+        "$edit", "$msg", "$root", "@a:x", 2
+    )
+    # already seen, e.g. sent then received in a sync response
+    store.add_messages("!room", [StoredMessage("$msg", None, None, "@a:x", 3)])
+    assert store.stats() == {"messages": 2}
+    store.close()
+
+    store = EventStore(tmp_path / "test.db")
+    assert store.get_original_id("!room", "$edit") == "$msg"
+    store.close()
+
+
+# the schema of the first version, which did not set user_version
+FIRST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS replacement (
+    room_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    original_id TEXT NOT NULL,
+    PRIMARY KEY (room_id, event_id)
+) WITHOUT ROWID;
+"""
+
+
+def test_migrate(tmp_path):
+    db = sqlite3.connect(tmp_path / "test.db")
+    db.executescript(FIRST_SCHEMA)
+    with db:
+        db.execute("INSERT INTO replacement VALUES ('!room', '$edit', '$msg')")
+    db.close()
+    store = EventStore(tmp_path / "test.db")
+    assert store.stats() == {"messages": 0}
+    store.close()
+    db = sqlite3.connect(tmp_path / "test.db")
+    assert db.execute("PRAGMA user_version").fetchone() == (len(MIGRATIONS),)
+    db.close()
+
+
+def test_failed_migration(tmp_path, monkeypatch):
+    EventStore(tmp_path / "test.db").close()
+    monkeypatch.setattr(
+        "matridge.store.MIGRATIONS",
+        [*MIGRATIONS, "CREATE TABLE new (x); INSERT INTO nope VALUES (1);"],
+    )
+    with pytest.raises(sqlite3.OperationalError):
+        EventStore(tmp_path / "test.db")
+    # not locked by a transaction left open
+    db = sqlite3.connect(tmp_path / "test.db", timeout=0)
+    with db:
+        db.execute("CREATE TABLE other (x)")
+    assert db.execute("PRAGMA user_version").fetchone() == (len(MIGRATIONS),)
+    assert not db.execute("SELECT * FROM sqlite_master WHERE name = 'new'").fetchall()
+    db.close()
+
+
+def test_account_data(tmp_path):
+    store = EventStore(tmp_path / "test.db")
+    assert store.get_account_data("m.direct") is None
+    store.set_account_data("m.direct", {"@a:x": ["!room"]})
+    store.set_account_data("m.direct", {"@b:x": ["!room2"]})
+    store.close()
+    store = EventStore(tmp_path / "test.db")
+    assert store.get_account_data("m.direct") == {"@b:x": ["!room2"]}
+    store.close()
+
+
+def test_batch(tmp_path):
+    store = EventStore(tmp_path / "test.db")
+    # fails at once if the store holds a write lock
+    other = sqlite3.connect(tmp_path / "test.db", timeout=0)
+
+    def count():
+        return other.execute("SELECT COUNT(*) FROM message").fetchone()[0]
+
+    with store.batch():
+        store.add_messages("!room", [StoredMessage("$a", None, None, "@a:x", 1)])
+        with store.batch():
+            store.add_messages("!room", [StoredMessage("$b", None, None, "@a:x", 2)])
+        assert store.get_message("!room", "$b") is not None
+        assert count() == 0
+    assert count() == 2
+
+    # not rolled back: they have been received anyway
+    with pytest.raises(ValueError):
+        with store.batch():
+            store.add_messages("!room", [StoredMessage("$c", None, None, "@a:x", 3)])
+            store.set_account_data("m.direct", {"@b:x": ["!room"]})
+            assert store.get_account_data("m.direct") == {"@b:x": ["!room"]}
+            # no transaction is left open while the batch waits
+            with other:
+                other.execute("INSERT INTO account_data VALUES ('other', '{}')")
+            raise ValueError
+    assert count() == 3
+    assert store.get_account_data("m.direct") == {"@b:x": ["!room"]}
+    other.close()
+    store.close()
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from matridge import config
+from matridge.metrics import metrics
+from matridge.tracing import collector, span, traced
+
+
+@traced
+async def inner():
+    with span("sleep"):
+        await asyncio.sleep(0)
+
+
+@traced
+async def outer():
+    with span("first"):
+        pass
+    await inner()
+
+
+@pytest.mark.asyncio
+async def test_not_sampled(monkeypatch):
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 0.0)
+    collector.traces.clear()
+    await outer()
+    assert len(collector.traces) == 0
+
+
+@pytest.mark.asyncio
+async def test_sampled(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(config, "TRACE_FILE", tmp_path / "traces.jsonl")
+    collector.traces.clear()
+    await outer()
+    assert len(collector.traces) == 1
+    trace = collector.traces[0]
+    assert trace.name == "outer"
+    assert [s.name for s in trace.spans] == ["first", "sleep", "inner"]
+    assert all(s.duration <= trace.duration for s in trace.spans)
+    assert "outer.inner" in metrics.stages
+    assert (tmp_path / "traces.jsonl").read_text().count("\n") == 1
+
+
+@pytest.mark.asyncio
+async def test_error(monkeypatch):
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 1.0)
+    collector.traces.clear()
+
+    @traced
+    async def fail():
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        await fail()
+    assert collector.traces[0].error == "RuntimeError()"
@@ -0,0 +1,30 @@
+import pytest
+from nio.crypto import OlmDevice, TrustState
+
+from matridge.fake_homeserver import FakeHomeserver
+from matridge.session import Session
+
+
+@pytest.mark.asyncio
+async def test_bulk_blacklist_rotates_group_sessions(
+    homeserver: FakeHomeserver, session: Session
+):
+    client = session.matrix
+    bob = homeserver.register("bob")
+    carol = homeserver.register("carol")
+    room_id = homeserver.create_room(bob, members=[client.user_id], encrypted=True)
+    other_id = homeserver.create_room(carol, members=[client.user_id], encrypted=True)
+    await client.sync(full_state=True)
+    assert client.olm is not None
+    for i in range(3):
+        client.device_store.add(OlmDevice(bob, f"BOB{i}", {"ed25519": f"key{i}"}))
+    for r in room_id, other_id:
+        client.olm.create_outbound_group_session(r)
+        client.olm.outbound_group_sessions[r].shared = True
+
+    changed = client.set_trust(TrustState.blacklisted, user_id=bob)
+
+    assert len(changed) == 3
+    assert room_id not in client.olm.outbound_group_sessions
+    assert client.olm.should_share_group_session(room_id)
+    assert other_id in client.olm.outbound_group_sessions